@@ -0,0 +1,195 @@
+"""Apply a saved filter recipe to every image in a directory tree, without the GUI.
+
+Usage:
+    python batch.py recipe.json input_dir output_dir [--workers N] [--tile-size PX [--tile-workers N]] [--explain]
+                    [--cache-dir DIR [--cache-max-mb MB]] [--sidecars]
+                    [--format jpeg|png|webp|tiff] [--quality Q] [--compression LEVEL] [--max-size PX]
+
+With --sidecars, images that have a recipe saved next to them (photo.jpg.recipe.json) are rendered
+with it, and the others with recipe.json. Results keep their input's format unless --format is given;
+with --tile-size, full-size TIFF results are streamed tile by tile and never held whole.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import cv2
+import numpy as np
+
+from effects.buffers import BufferPool
+from effects.export import DEFAULT_COMPRESSION, DEFAULT_QUALITY, EXPORT_FORMATS, EXTENSION_FORMATS, ExportOptions, \
+    export_path, stream_tiff, validate_options, write_image
+from effects.pipeline import run_pipeline
+from effects.planner import explain
+from effects.recipe import load_recipe, load_sidecar, plan_recipe, recipe_id, recipe_working_space
+from effects.render_cache import DEFAULT_DISK_CACHE_BYTES, DiskRenderCache, render_key, source_digest
+from effects.tiling import load_source, render_file_tiled
+from utils.profiling import StageProfiler, enable_json_log
+
+# .npy arrays are memory-mapped, which lets tiled rendering handle images larger than RAM
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp", ".npy")
+
+
+def find_images(input_dir):
+    """Yield the path of every image under input_dir, relative to it."""
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), input_dir)
+
+
+_profiler = None
+_disk_cache = None
+_buffers = BufferPool()  # Stage outputs, reused by the next image of the same size
+
+
+def init_worker(profile_log=None, cache_dir=None, cache_max_bytes=DEFAULT_DISK_CACHE_BYTES):
+    global _profiler, _disk_cache
+    # The pool already uses every core, OpenCV's own threads would only oversubscribe them
+    cv2.setNumThreads(1)
+    if profile_log:
+        enable_json_log(profile_log)
+        _profiler = StageProfiler()
+    if cache_dir:
+        _disk_cache = DiskRenderCache(cache_dir, cache_max_bytes)
+
+
+def process_image(recipe, input_path, output_path, tile_size=None, tile_workers=1, show_plan=False,
+                  options=ExportOptions()):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    working_space = recipe_working_space(recipe)
+    source = load_source(input_path)
+    execution_plan = plan_recipe(recipe, source.shape)
+    if show_plan:
+        print(f"{input_path}: {explain(execution_plan)}")
+    if tile_size:
+        if EXTENSION_FORMATS.get(os.path.splitext(output_path)[1].lower()) == "tiff" and options.max_size is None:
+            return stream_tiff(source, execution_plan.stages, output_path, options, tile_size, tile_workers,
+                               working_space)
+        return render_file_tiled(input_path, output_path, execution_plan.stages, tile_size, workers=tile_workers,
+                                 working_space=working_space, write=partial(_write_result, options=options),
+                                 source=source)
+
+    cache_key = None
+    if _disk_cache is not None and execution_plan.stages:
+        cache_key = render_key(source_digest(source), execution_plan.stages, working_space)
+        cached = _disk_cache.get(cache_key)
+        if cached is not None:
+            _write_result(output_path, cached, options)
+            return f"{output_path} (cached)"
+    if _profiler is None:
+        result = run_pipeline(source, execution_plan.stages, working_space=working_space, buffers=_buffers)
+    else:
+        _profiler.begin(input_path)
+        result = run_pipeline(source, execution_plan.stages, run_stage=_profiler.run_stage,
+                              working_space=working_space, buffers=_buffers)
+        _profiler.end()
+    _write_result(output_path, result, options)
+    if cache_key is not None:
+        _disk_cache.put(cache_key, result)
+    if result is not source:
+        _buffers.give(result)
+    return output_path
+
+
+def _write_result(output_path, result, options=ExportOptions()):
+    if output_path.lower().endswith(".npy"):
+        np.save(output_path, result)
+    elif output_path.lower().endswith(tuple(EXTENSION_FORMATS)):
+        write_image(result, output_path, options)
+    elif not cv2.imwrite(output_path, result):
+        raise ValueError(f"Failed to write image: {output_path}")
+
+
+def _output_path(output_dir, path, options):
+    output_path = os.path.join(output_dir, path)
+    return export_path(output_path, options.format) if options.format else output_path
+
+
+def group_by_recipe(recipe, input_dir, paths, sidecars=False):
+    """Return [(recipe, path), ...] for the images, those sharing a recipe next to each other.
+
+    With sidecars, an image's own saved recipe replaces recipe. Keeping images with identical recipes
+    together lets each worker build the lookup tables of a recipe once and reuse them for the rest.
+    """
+    jobs = []
+    for path in paths:
+        own = load_sidecar(os.path.join(input_dir, path)) if sidecars else None
+        jobs.append((own or recipe, path))
+    order = {}
+    for job_recipe, _ in jobs:
+        order.setdefault(recipe_id(job_recipe), len(order))
+    return sorted(jobs, key=lambda job: order[recipe_id(job[0])])
+
+
+def run_batch(recipe, input_dir, output_dir, workers=None, tile_size=None, tile_workers=1, profile_log=None,
+              show_plan=False, cache_dir=None, cache_max_bytes=DEFAULT_DISK_CACHE_BYTES, sidecars=False,
+              options=ExportOptions()):
+    """Render every image under input_dir into the same relative path under output_dir.
+
+    With cache_dir, renders are looked up in and added to a DiskRenderCache there, so rerunning a
+    batch only renders images or settings that changed. Tiled renders are never cached. With
+    sidecars, images are rendered with the recipe saved next to them where they have one. options
+    (ExportOptions) set the encoding; with a format, outputs take its extension.
+    """
+    validate_options(options)
+    jobs = group_by_recipe(recipe, input_dir, list(find_images(input_dir)), sidecars)
+    recipes = len({recipe_id(job_recipe) for job_recipe, _ in jobs})
+    print(f"Processing {len(jobs)} images ({recipes} distinct recipes) with {workers or os.cpu_count()} workers...")
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(profile_log, cache_dir, cache_max_bytes)) as pool:
+        futures = {
+            pool.submit(process_image, job_recipe, os.path.join(input_dir, path),
+                        _output_path(output_dir, path, options), tile_size, tile_workers, show_plan, options): path
+            for job_recipe, path in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                print(f"[{done}/{len(jobs)}] {future.result()}")
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(jobs)}] Error processing {futures[future]}: {e}")
+    print(f"Done in {time.perf_counter() - start:.1f}s, {failures} failed.")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a filter recipe to a directory of images.")
+    parser.add_argument("recipe", help="JSON recipe with 'blurs', 'intensity' and 'adjustments'")
+    parser.add_argument("input_dir", help="Directory tree to read images from")
+    parser.add_argument("output_dir", help="Directory tree to write results to")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="Render in tiles of this many pixels through memory-mapped files, for very large images")
+    parser.add_argument("--tile-workers", type=int, default=1,
+                        help="Threads rendering the tiles of each image (use with few, very large images)")
+    parser.add_argument("--profile-log", help="Append per-stage timings of every image to this JSON lines file")
+    parser.add_argument("--explain", action="store_true",
+                        help="Print the execution plan and estimated cost chosen for every image")
+    parser.add_argument("--cache-dir", help="Reuse renders cached in this directory and cache new ones there")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_DISK_CACHE_BYTES // 2 ** 20,
+                        help="Size of the render cache before the least recently used renders are deleted")
+    parser.add_argument("--sidecars", action="store_true",
+                        help="Render images that have a saved recipe next to them with that recipe instead")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), help="Write results in this format")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="JPEG and WebP quality, 1-100")
+    parser.add_argument("--compression", type=int, default=DEFAULT_COMPRESSION,
+                        help="PNG and TIFF compression level, 0-9 (0 writes uncompressed TIFFs)")
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="Shrink results whose long edge is larger than this many pixels")
+    args = parser.parse_args(argv)
+
+    recipe = load_recipe(args.recipe)
+    failures = run_batch(recipe, args.input_dir, args.output_dir, args.workers, args.tile_size, args.tile_workers,
+                         args.profile_log, args.explain, args.cache_dir, args.cache_max_mb * 2 ** 20,
+                         args.sidecars, ExportOptions(args.format, args.quality, args.compression, args.max_size))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Compare the box-pass Gaussian engine with cv2.GaussianBlur across blur radii.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_blur_engines --size 6 --intensities 1 10 20 50 100
+
+For each intensity, reports the p50 latency and throughput of both engines and how far the
+box-pass result strays from cv2.GaussianBlur (largest and mean absolute difference, PSNR).
+Box blur is timed too: cv2.blur keeps running sums, so its cost should stay flat as well. So
+should the median's, which is compared against a single cv2.medianBlur call and must match it exactly.
+Last, the guided-filter bilateral blur is timed against the half-size cv2.bilateralFilter it replaced
+at high intensities; apply_bilateral_blur switches to it from GUIDED_MIN_INTENSITY up.
+"""
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.bench_effects import synthetic_image, percentile
+from effects.filters import fast_gaussian_blur, gaussian_sigma, apply_median_blur, apply_bilateral_blur, \
+    FAST_GAUSSIAN_MIN_RADIUS, GUIDED_MIN_INTENSITY
+
+DEFAULT_INTENSITIES = (1, 5, 10, 20, 30, 50, 100)
+
+
+def time_call(function, repeats):
+    function()  # Warm up
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        latencies.append(time.perf_counter() - start)
+    return percentile(latencies, 50), result
+
+
+def compare_engines(image, intensity, repeats):
+    ksize = 2 * intensity + 3
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    direct_s, direct = time_call(lambda: cv2.GaussianBlur(image, (ksize, ksize), 0), repeats)
+    fast_s, fast = time_call(lambda: fast_gaussian_blur(image, gaussian_sigma(ksize)), repeats)
+    box_size = max(3, intensity * 3)
+    box_s, _ = time_call(lambda: cv2.blur(image, (box_size, box_size)), repeats)
+    median_single_s, median_single = time_call(lambda: cv2.medianBlur(image, ksize), repeats)
+    median_s, median = time_call(lambda: apply_median_blur(image, intensity), repeats)
+    bilateral_s, _ = time_call(lambda: apply_bilateral_blur(image, intensity, engine="bilateral"), repeats)
+    guided_s, _ = time_call(lambda: apply_bilateral_blur(image, intensity, engine="guided"), repeats)
+
+    difference = np.abs(direct.astype(np.int16) - fast.astype(np.int16))
+    mse = float(np.mean(difference.astype(np.float64) ** 2))
+    return {
+        "intensity": intensity,
+        "radius": ksize // 2,
+        "engine": "box passes" if ksize // 2 >= FAST_GAUSSIAN_MIN_RADIUS else "cv2.GaussianBlur",
+        "gaussian_p50_s": direct_s,
+        "fast_p50_s": fast_s,
+        "box_p50_s": box_s,
+        "median_single_p50_s": median_single_s,
+        "median_p50_s": median_s,
+        "median_identical": bool(np.array_equal(median, median_single)),
+        "bilateral_p50_s": bilateral_s,
+        "guided_p50_s": guided_s,
+        "bilateral_engine": "guided" if intensity >= GUIDED_MIN_INTENSITY else "bilateral",
+        "gaussian_mp_per_s": megapixels / direct_s,
+        "fast_mp_per_s": megapixels / fast_s,
+        "max_error": int(difference.max()),
+        "mean_error": float(difference.mean()),
+        "psnr_db": 10 * np.log10(255 ** 2 / mse) if mse > 0 else float("inf"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare Gaussian blur engines.")
+    parser.add_argument("--size", type=float, default=6, help="Image size in megapixels (default: %(default)s)")
+    parser.add_argument("--intensities", type=int, nargs="+", default=list(DEFAULT_INTENSITIES))
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per engine")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    image = synthetic_image(args.size)
+    results = []
+    print(f"{'intensity':>9} {'radius':>6} {'GaussianBlur':>13} {'box passes':>11} {'cv2.blur':>9} "
+          f"{'max err':>7} {'mean err':>8} {'PSNR':>7} {'median 1T':>10} {'median':>9} "
+          f"{'bilateral':>10} {'guided':>9}  selected  bilateral selected")
+    for intensity in args.intensities:
+        row = compare_engines(image, intensity, args.repeats)
+        results.append(row)
+        print(f"{intensity:9d} {row['radius']:6d} {row['gaussian_p50_s'] * 1000:10.1f} ms "
+              f"{row['fast_p50_s'] * 1000:8.1f} ms {row['box_p50_s'] * 1000:6.1f} ms "
+              f"{row['max_error']:7d} {row['mean_error']:8.3f} {row['psnr_db']:5.1f}dB "
+              f"{row['median_single_p50_s'] * 1000:7.1f} ms {row['median_p50_s'] * 1000:6.1f} ms"
+              f"{'' if row['median_identical'] else ' (MISMATCH)'} "
+              f"{row['bilateral_p50_s'] * 1000:7.1f} ms {row['guided_p50_s'] * 1000:6.1f} ms  {row['engine']:<16}  {row['bilateral_engine']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"shape": list(image.shape), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
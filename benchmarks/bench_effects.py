@@ -0,0 +1,286 @@
+"""Benchmark every filter and adjustment across image sizes and slider values.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_effects --sizes 1 4 16 --output results.json
+    python -m benchmarks.bench_effects --baseline results.json --threshold 0.15
+
+Each case reports p50/p99 latency, throughput in megapixels per second and the peak memory
+allocated while it ran. With --baseline, cases whose p50 latency regressed by more than the
+threshold are listed and the exit status is 1.
+
+    python -m benchmarks.bench_effects --sizes 1 --check-luts
+
+With --check-luts, fused lookup tables are also compared with running their adjustments one by
+one (effects.lut.compare_with_chain), and the exit status is 1 if any exceeds its tolerance.
+
+    python -m benchmarks.bench_effects --sizes 16 --only none --speedup --tile-workers 1 2 4 8
+
+With --speedup, a typical chain is also rendered tile-parallel (effects.tiling) on each number of
+workers, by default powers of two up to the core count, and its speedup over one worker is
+reported. The exit status is 1 if any worker count changes the result.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from effects.lut import compare_with_chain, CHANNEL_LUT_TOLERANCE, COLOUR_LUT_TOLERANCE
+from effects.pipeline import build_stages
+from effects.registry import OPERATIONS, operations_of_kind
+from effects.tiling import measure_speedup
+
+# Values sampled from each slider's range; --full-sweep uses every value instead
+BLUR_SAMPLES = (1, 5, 10, 20)
+ADJUSTMENT_SAMPLES = (-100, -50, 50, 100)
+# Control points of the sampled tone curves: a gentle S and a steep S
+CURVE_SAMPLES = (((0, 0), (64, 56), (192, 200), (255, 255)), ((0, 0), (64, 32), (128, 128), (192, 224), (255, 255)))
+
+# Runs of point adjustments fused into one lookup table by effects.pipeline, checked by --check-luts.
+# Every channel adjustment at once is one channel table; the rest mix in colour adjustments.
+LUT_CHECK_CHAINS = (
+    tuple((name, 50) for name, operation in OPERATIONS.items()
+          if operation.point == "channel" and operation.kind == "adjustment"),
+    (("Highlights", 30), ("Saturation", 40)),
+    (("Temperature", 20), ("Saturation", -30), ("Contrast", 15)),
+    (("Exposure", -20), ("Highlights", -100), ("Saturation", 100)),
+)
+
+# Chain rendered by --speedup: blurs, a spatial adjustment and a fused run of point adjustments
+SPEEDUP_CHAIN = ({"gaussian": True, "median": True}, 5, {"Temperature": 20, "Contrast": 10, "Sharpness": 30})
+
+DEFAULT_SIZES_MP = (1, 4, 16)
+DEFAULT_REPEATS = 5
+DEFAULT_CASE_SECONDS = 10.0
+
+
+def synthetic_image(megapixels, seed=0):
+    """Return a reproducible 3:2 BGR image with smooth gradients, edges and sensor-like noise."""
+    width = int(round((megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[..., 0] = 255 * x
+    image[..., 1] = 255 * y
+    image[..., 2] = 255 * ((np.floor(x * 16) + np.floor(y * 16)) % 2)  # Hard edges for spatial filters
+    image += rng.normal(0, 12, size=(height, width, 1)).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def sweep_values(value_range, samples, full_sweep):
+    low, high = value_range
+    if full_sweep:
+        return [value for value in range(low, high + 1) if value != 0]
+    return [value for value in samples if low <= value <= high and value != 0] or [high]
+
+
+def iter_cases(full_sweep):
+    """Yield (kind, name, function, value) for every benchmarked call."""
+    for name, operation in operations_of_kind("blur").items():
+        for value in sweep_values(operation.value_range, BLUR_SAMPLES, full_sweep):
+            yield "filter", name, operation.function, value
+    for name, operation in operations_of_kind("adjustment").items():
+        for value in sweep_values(operation.value_range, ADJUSTMENT_SAMPLES, full_sweep):
+            yield "adjustment", name, operation.function, value
+    for name, operation in operations_of_kind("curve").items():
+        for points in CURVE_SAMPLES:
+            yield "adjustment", name, operation.function, points
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q))
+
+
+def run_case(function, image, value, repeats, max_seconds):
+    """Time function(image, value) and measure the memory it allocates at its peak."""
+    latencies = []
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        function(image, value)  # Warm up caches and lazily built tables
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function(image, value)
+            latencies.append(time.perf_counter() - start)
+            if time.perf_counter() - started > max_seconds:
+                break
+
+        # Separate run for memory, tracing slows the calls down. NumPy reports its buffers to
+        # tracemalloc, which includes every array OpenCV returns to Python.
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        function(image, value)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return latencies, peak
+
+
+def case_id(kind, name, value, megapixels):
+    return f"{kind}:{name}:{value}@{megapixels}MP"
+
+
+def run_benchmarks(sizes, repeats, max_seconds, full_sweep, only=None):
+    results = []
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        actual_mp = image.shape[0] * image.shape[1] / 1e6
+        for kind, name, function, value in iter_cases(full_sweep):
+            if only and name not in only:
+                continue
+            latencies, peak = run_case(function, image, value, repeats, max_seconds)
+            p50 = percentile(latencies, 50)
+            result = {
+                "id": case_id(kind, name, value, megapixels),
+                "kind": kind,
+                "name": name,
+                "value": value,
+                "megapixels": actual_mp,
+                "shape": list(image.shape),
+                "runs": len(latencies),
+                "p50_s": p50,
+                "p99_s": percentile(latencies, 99),
+                "mp_per_s": actual_mp / p50 if p50 > 0 else float("inf"),
+                "peak_bytes": peak,
+            }
+            results.append(result)
+            print(f"{result['id']:<36} p50 {p50 * 1000:9.2f} ms  p99 {result['p99_s'] * 1000:9.2f} ms  "
+                  f"{result['mp_per_s']:8.1f} MP/s  peak {peak / 2 ** 20:8.1f} MiB")
+    return results
+
+
+def check_luts(sizes):
+    """Compare every LUT_CHECK_CHAINS table with its sequential chain; return results and failed ids."""
+    results = []
+    failures = []
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        for chain in LUT_CHECK_CHAINS:
+            per_channel = all(OPERATIONS[name].point == "channel" for name, _ in chain)
+            tolerance = CHANNEL_LUT_TOLERANCE if per_channel else COLOUR_LUT_TOLERANCE
+            steps = [(OPERATIONS[name].function, value) for name, value in chain]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                max_diff, fraction, rest_fraction = compare_with_chain(image, steps, per_channel)
+            result = {
+                "id": f"lut:{'+'.join(f'{name}={value}' for name, value in chain)}@{megapixels}MP",
+                "per_channel": per_channel,
+                "max_diff": max_diff,
+                "fraction": fraction,
+                "tolerance": tolerance,
+                "unaligned_fraction": rest_fraction,
+            }
+            results.append(result)
+            flag = ""
+            if fraction > tolerance:
+                failures.append(result["id"])
+                flag = "  ABOVE TOLERANCE"
+            print(f"{result['id']}\n    {'channel' if per_channel else 'colour'} table: max diff {max_diff}, "
+                  f"{fraction:.5f} of values differ (tolerance {tolerance}), "
+                  f"{rest_fraction:.5f} in the unaligned columns{flag}")
+    return results, failures
+
+
+def check_speedup(sizes, worker_counts=None):
+    """Time SPEEDUP_CHAIN tile-parallel at each worker count; return results and the ids that changed."""
+    results = []
+    mismatches = []
+    stages = build_stages(*SPEEDUP_CHAIN)
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        print(f"Tile-parallel speedup at {megapixels} MP on {os.cpu_count()} core(s):")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            rows = measure_speedup(image, stages, worker_counts=worker_counts)
+        for row in rows:
+            result = {"id": f"speedup:{row['workers']}@{megapixels}MP", "megapixels": megapixels, **row}
+            results.append(result)
+            if not row["identical"]:
+                mismatches.append(result["id"])
+            print(f"{row['workers']:5d} worker(s) {row['seconds'] * 1000:9.1f} ms  x{row['speedup']:.2f}"
+                  f"{'' if row['identical'] else '  (MISMATCH)'}")
+    return results, mismatches
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "numpy": np.__version__,
+    }
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """Print the p50 change of every case found in the baseline and return the regressed ids."""
+    previous = {result["id"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get(result["id"])
+        if before is None:
+            continue
+        change = result["p50_s"] / before["p50_s"] - 1.0 if before["p50_s"] > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(result["id"])
+            flag = "  REGRESSION"
+        print(f"{result['id']:<36} {before['p50_s'] * 1000:9.2f} ms -> {result['p50_s'] * 1000:9.2f} ms "
+              f"({change:+.1%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the effects functions.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(DEFAULT_SIZES_MP),
+                        help="Image sizes in megapixels (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Timed runs per case")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_CASE_SECONDS,
+                        help="Stop repeating a case once it has run this long")
+    parser.add_argument("--full-sweep", action="store_true", help="Benchmark every slider value")
+    parser.add_argument("--only", nargs="+", help="Only these filters/adjustments, e.g. gaussian Noise")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a JSON file written by --output")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="p50 slowdown counted as a regression (default: %(default)s)")
+    parser.add_argument("--check-luts", action="store_true",
+                        help="Also check fused lookup tables against their sequential chains")
+    parser.add_argument("--speedup", action="store_true",
+                        help="Also report the speedup of tile-parallel rendering over one worker")
+    parser.add_argument("--tile-workers", type=int, nargs="+",
+                        help="Worker counts for --speedup (default: powers of two up to the core count)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeats, args.max_seconds, args.full_sweep, args.only)
+    report = {"environment": environment(), "results": results}
+    failures = []
+    lut_failures = []
+    if args.check_luts:
+        report["lut_checks"], lut_failures = check_luts(args.sizes)
+        failures += lut_failures
+        print(f"{len(lut_failures)} lookup table(s) above tolerance.")
+    if args.speedup:
+        report["speedup"], speedup_mismatches = check_speedup(args.sizes, args.tile_workers)
+        print(f"{len(speedup_mismatches)} tile-parallel render(s) differ from one worker's.")
+        failures += speedup_mismatches
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}.")
+        return 1 if regressions or failures else 0
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Compare rendering chains in the 8-bit and the float32 working space.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_working_space --sizes 1 6 --output working_space.json
+
+Every chain is rendered three ways: 8-bit with the stages run one by one, 8-bit as planned by
+effects.planner (fused lookup tables), and in float32, quantised once at the end. Each
+reports its p50 latency, throughput and peak allocated memory. To show the banding the 8-bit path
+compounds, every chain is also run over a smooth 0-255 ramp, counting the distinct output levels
+(more is smoother) and the largest deviation from a float64 render of the same chain.
+
+With --pooled, renders take their buffers from a BufferPool and give the result back, as the
+interactive and batch paths do, so the peak memory shows what a steady-state render allocates.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from benchmarks.bench_effects import synthetic_image, percentile, run_case, environment
+from effects.buffers import BufferPool
+from effects.pipeline import build_stages, run_pipeline
+from effects.planner import plan
+
+# name: (blurs, intensity, adjustments)
+CHAINS = {
+    "tone": ((), 5, {"Temperature": 20, "Exposure": -40, "Contrast": 30, "Shadows": 30, "Saturation": 20}),
+    "detail": (("gaussian",), 5, {"Clarity": 30, "Sharpness": 40}),
+    "mixed": (("gaussian", "bilateral"), 5, {"Exposure": -40, "Highlights": 30, "Shadows": 40, "Sharpness": 40,
+                                            "Defringe": 20}),
+    # Darkening then brightening back throws away half the levels at 8 bits
+    "round trip": ((), 5, {"Exposure": -50, "Contrast": 100}),
+}
+
+DEFAULT_SIZES_MP = (1, 6)
+
+
+def chain_stages(chain):
+    blurs, intensity, adjustments = CHAINS[chain]
+    return build_stages({name: True for name in blurs}, intensity, adjustments, fuse=False)
+
+
+def ramp_image(width=1024, height=64):
+    """Return a grey ramp from 0 to 255 with a slight colour tilt, smooth enough to show banding."""
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    image = np.repeat(np.repeat(ramp, height, axis=0), 3, axis=2)
+    image *= np.array([0.9, 1.0, 0.95], dtype=np.float32)
+    return np.rint(image).astype(np.uint8)
+
+
+def render_modes(stages, shape, buffers=None):
+    """Return {mode: render(image)} for the 8-bit, planned 8-bit and float32 ways of running stages."""
+    planned = plan(stages, shape).stages
+    return {
+        "uint8": lambda image: run_pipeline(image, stages, buffers=buffers),
+        "uint8 planned": lambda image: run_pipeline(image, planned, buffers=buffers),
+        "float32": lambda image: run_pipeline(image, stages, working_space="float32", buffers=buffers),
+    }
+
+
+def banding(stages):
+    """Return {mode: (distinct levels, largest deviation from float64)} on the ramp."""
+    ramp = ramp_image()
+    reference = ramp.astype(np.float64)
+    for _, function, value in stages:
+        reference = function(reference.astype(np.float32), value).astype(np.float64)
+    reference = np.clip(np.rint(reference), 0, 255)
+    rows = {}
+    for mode, render in render_modes(stages, ramp.shape).items():
+        result = render(ramp)
+        rows[mode] = (int(np.unique(result[..., 1]).size), int(np.abs(result - reference).max()))
+    return rows
+
+
+def run_benchmarks(sizes, repeats, max_seconds, chains, pooled=False):
+    results = []
+    for chain in chains:
+        stages = chain_stages(chain)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            levels = banding(stages)
+        for megapixels in sizes:
+            image = synthetic_image(megapixels)
+            actual_mp = image.shape[0] * image.shape[1] / 1e6
+            buffers = BufferPool() if pooled else None
+            for mode, render in render_modes(stages, image.shape, buffers).items():
+                if pooled:
+                    latencies, peak = run_case(lambda source, _: buffers.give(render(source)), image, None, repeats,
+                                               max_seconds)
+                else:
+                    latencies, peak = run_case(lambda source, _: render(source), image, None, repeats, max_seconds)
+                p50 = percentile(latencies, 50)
+                result = {
+                    "chain": chain,
+                    "mode": mode,
+                    "pooled": pooled,
+                    "megapixels": actual_mp,
+                    "p50_s": p50,
+                    "mp_per_s": actual_mp / p50 if p50 > 0 else float("inf"),
+                    "peak_bytes": peak,
+                    "levels": levels[mode][0],
+                    "max_error": levels[mode][1],
+                }
+                results.append(result)
+                print(f"{chain:<11} {mode:<14} {megapixels:5.1f} MP  p50 {p50 * 1000:9.2f} ms  "
+                      f"{result['mp_per_s']:7.1f} MP/s  peak {peak / 2 ** 20:8.1f} MiB  "
+                      f"levels {result['levels']:3d}  max err {result['max_error']:3d}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the 8-bit and float32 working spaces.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=list(DEFAULT_SIZES_MP),
+                        help="Image sizes in megapixels (default: %(default)s)")
+    parser.add_argument("--chains", nargs="+", default=list(CHAINS), choices=list(CHAINS))
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--max-seconds", type=float, default=10.0,
+                        help="Stop repeating a case once it has run this long")
+    parser.add_argument("--pooled", action="store_true", help="Reuse buffers from one render to the next")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeats, args.max_seconds, args.chains, args.pooled)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,103 +1,159 @@
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
-
-def adjust_temperature(image, delta):
+from effects.buffers import SCRATCH
+from effects.filters import scale_ksize
+from effects.tone import gamma_lut
+from effects.working_space import is_float, float_stage
+
+# Denoise engines for reduce_noise, best first: (template window, search window, colour NLM) and the
+# trade-off shown in the UI. Timings are for 1 MP on one core.
+NOISE_ENGINES = {
+    "nlm": (7, 21, True, "Colour non-local means. Best detail and colour, about 2 s per megapixel."),
+    "luma": (7, 21, False, "Non-local means on brightness, colour noise blurred. About 2x faster, "
+                           "colour noise is smoothed less precisely."),
+    "fast": (7, 11, False, "Brightness only with a smaller search. About 6x faster, slightly blotchier "
+                           "at high strength. Used for previews."),
+}
+DEFAULT_NOISE_ENGINE = "nlm"
+
+
+def _float_hsv(image, hsv):
+    # OpenCV expects float images in 0-1 for HSV, with hue in degrees
+    np.multiply(image, np.float32(1 / 255.0), out=hsv)
+    return cv2.cvtColor(hsv, cv2.COLOR_BGR2HSV, dst=hsv)
+
+
+def _float_bgr(hsv, out):
+    image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=out)
+    image *= 255
+    return image
+
+
+@lru_cache(maxsize=64)
+def _hsv_offset_lut(channel, delta):
+    """Return a (1, 256, 3) table adding delta to one HSV channel with clipping, leaving the others."""
+    lut = np.repeat(np.arange(256, dtype=np.int16), 3).reshape(1, 256, 3)
+    lut[..., channel] = np.clip(lut[..., channel] + delta, 0, 255)
+    return lut.astype(np.uint8)
+
+
+def _offset_hsv(image, channel, delta, limit, out):
+    """Add delta to one HSV channel of image without splitting it into planes."""
+    with SCRATCH.borrow(image.shape, image.dtype) as hsv:
+        if not is_float(image):
+            cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+            cv2.LUT(hsv, _hsv_offset_lut(channel, delta), dst=hsv)
+            return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=out)
+        _float_hsv(image, hsv)
+        plane = hsv[..., channel]
+        plane += delta / 255.0
+        np.clip(plane, 0, limit, out=plane)
+        return _float_bgr(hsv, out)
+
+
+def adjust_temperature(image, delta, out=None):
     """Adjust the color temperature of the image."""
     try:
-        blue, green, red = cv2.split(image)
-        red = cv2.addWeighted(red, 1.0, red, 0, delta)
-        blue = cv2.addWeighted(blue, 1.0, blue, 0, -delta)
         print(f"Adjusting temperature with delta: {delta}")
-        return cv2.merge((blue, green, red))
+        if is_float(image):
+            return np.add(image, np.array([-delta, 0, delta], dtype=np.float32), out=out)
+        return cv2.add(image, (-delta, 0, delta, 0), dst=out)
     except Exception as e:
         print(f"Error in adjust_temperature: {e}")
         return image
 
 
-def adjust_tint(image, delta):
+def adjust_tint(image, delta, out=None):
     """Adjust the tint of the image."""
     try:
-        blue, green, red = cv2.split(image)
-        green = cv2.addWeighted(green, 1.0, green, 0, delta)
         print(f"Adjusting tint with delta: {delta}")
-        return cv2.merge((blue, green, red))
+        if is_float(image):
+            return np.add(image, np.array([0, delta, 0], dtype=np.float32), out=out)
+        return cv2.add(image, (0, delta, 0, 0), dst=out)
     except Exception as e:
         print(f"Error in adjust_tint: {e}")
         return image
 
 
-def adjust_exposure(image, delta):
+def adjust_exposure(image, delta, out=None):
     """Adjust the exposure of the image."""
     try:
         print(f"Adjusting exposure with delta: {delta}")
-        return cv2.convertScaleAbs(image, alpha=1.0 + delta / 100.0, beta=0)
+        if is_float(image):
+            return np.multiply(image, np.float32(1.0 + delta / 100.0), out=out)
+        return cv2.convertScaleAbs(image, dst=out, alpha=1.0 + delta / 100.0, beta=0)
     except Exception as e:
         print(f"Error in adjust_exposure: {e}")
         return image
 
 
-def adjust_contrast(image, delta):
+def adjust_contrast(image, delta, out=None):
     """Adjust the contrast of the image."""
     try:
         print(f"Adjusting contrast with delta: {delta}")
-        return cv2.convertScaleAbs(image, alpha=1.0 + delta / 100.0, beta=0)
+        if is_float(image):
+            return np.multiply(image, np.float32(1.0 + delta / 100.0), out=out)
+        return cv2.convertScaleAbs(image, dst=out, alpha=1.0 + delta / 100.0, beta=0)
     except Exception as e:
         print(f"Error in adjust_contrast: {e}")
         return image
 
 
-def adjust_highlights(image, delta):
+def adjust_highlights(image, delta, out=None):
     """Brighten highlights in the image."""
     try:
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        v = np.clip(v + delta, 0, 255).astype(np.uint8)
         print(f"Adjusting highlights with delta: {delta}")
-        return cv2.cvtColor(cv2.merge((h, s, v)), cv2.COLOR_HSV2BGR)
+        # Float brightness may exceed 1, it has no headroom below black
+        return _offset_hsv(image, 2, delta, np.inf, out)
     except Exception as e:
         print(f"Error in adjust_highlights: {e}")
         return image
 
 
-def adjust_shadows(image, delta):
+def adjust_shadows(image, delta, out=None):
     """Brighten shadows in the image."""
     try:
         gamma = 1.0 + delta / 100.0
         invGamma = 1.0 / gamma
-        lut = np.array([((i / 255.0) ** invGamma) * 255 for i in range(256)]).astype("uint8")
         print(f"Adjusting shadows with delta: {delta}")
-        return cv2.LUT(image, lut)
+        if is_float(image):
+            result = np.maximum(image, 0, out=out)
+            result *= np.float32(1 / 255.0)
+            cv2.pow(result, invGamma, dst=result)
+            result *= 255
+            return result
+        return cv2.LUT(image, gamma_lut(gamma), dst=out)
     except Exception as e:
         print(f"Error in adjust_shadows: {e}")
         return image
 
 
-def adjust_clarity(image, delta):
+def adjust_clarity(image, delta, out=None):
     """Add clarity by enhancing edges."""
     try:
         kernel = np.array([[0, -1, 0], [-1, 5 + delta / 10.0, -1], [0, -1, 0]])
         print(f"Adjusting clarity with delta: {delta}")
-        return cv2.filter2D(image, -1, kernel)
+        return cv2.filter2D(image, -1, kernel, dst=out)
     except Exception as e:
         print(f"Error in adjust_clarity: {e}")
         return image
 
 
-def adjust_saturation(image, delta):
+def adjust_saturation(image, delta, out=None):
     """Adjust the saturation of the image."""
     try:
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        s = np.clip(s + delta, 0, 255).astype(np.uint8)
         print(f"Adjusting saturation with delta: {delta}")
-        return cv2.cvtColor(cv2.merge((h, s, v)), cv2.COLOR_HSV2BGR)
+        # Float saturation outside 0-1 is not a colour
+        return _offset_hsv(image, 1, delta, 1.0, out)
     except Exception as e:
         print(f"Error in adjust_saturation: {e}")
         return image
 
 
-def adjust_sharpness(image, delta):
+def adjust_sharpness(image, delta, out=None):
     """Sharpen the image without affecting exposure or intensity."""
     try:
         if delta == 0:
@@ -109,45 +165,71 @@ def adjust_sharpness(image, delta):
                            [-1, 5, -1],
                            [0, -1, 0]])
 
-        # Extract the edge details using the sharpening kernel
-        edges = cv2.filter2D(image, -1, kernel)
-
-        # Blend the edges back into the original image with controlled intensity
-        sharpness_strength = delta / 50.0  # Adjust this scaling factor as needed
-        sharpened = cv2.addWeighted(image, 1.0, edges - image, sharpness_strength, 0)
-
         print(f"Adjusting sharpness with delta: {delta}")
-        return np.clip(sharpened, 0, 255).astype(np.uint8)
+        with SCRATCH.borrow(image.shape, image.dtype) as edges:
+            # Extract the edge details using the sharpening kernel
+            cv2.filter2D(image, -1, kernel, dst=edges)
+
+            # Blend the edges back into the original image with controlled intensity
+            sharpness_strength = delta / 50.0  # Adjust this scaling factor as needed
+            # image + strength * (edges - image), without forming edges - image, which wraps around in uint8
+            return cv2.addWeighted(image, 1.0 - sharpness_strength, edges, sharpness_strength, 0, dst=out)
     except Exception as e:
         print(f"Error in adjust_sharpness: {e}")
         return image
 
 
-def reduce_noise(image, delta):
-    """Reduce noise in the image."""
+def noise_chroma_ksize(delta, scale=1.0):
+    """Return the blur kernel the luma-only denoise engines apply to colour, growing with strength."""
+    return scale_ksize(min(2 * (delta // 5) + 3, 31), scale)
+
+
+@float_stage  # Non-local means only takes 8-bit images
+def reduce_noise(image, delta, scale=1.0, engine=DEFAULT_NOISE_ENGINE, out=None):
+    """Reduce noise in the image with one of NOISE_ENGINES."""
     try:
-        print(f"Reducing noise with delta: {delta}")
-        return cv2.fastNlMeansDenoisingColored(image, None, delta, delta, 7, 21)
+        print(f"Reducing noise with delta: {delta} ({engine})")
+        template_window, search_window, colour, _ = NOISE_ENGINES[engine]
+        search_window = max(7, scale_ksize(search_window, scale))
+        if colour:
+            return cv2.fastNlMeansDenoisingColored(image, out, delta, delta, template_window, search_window)
+
+        height, width = image.shape[:2]
+        with SCRATCH.borrow(image.shape, np.uint8) as ycrcb, SCRATCH.borrow((height, width), np.uint8) as luma, \
+                SCRATCH.borrow((height, width), np.uint8) as denoised:
+            cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb, dst=ycrcb)
+            cv2.extractChannel(ycrcb, 0, dst=luma)
+            cv2.fastNlMeansDenoising(luma, denoised, delta, template_window, search_window)
+            # Blurring all three channels in place gives the same chroma as blurring it alone, and the
+            # blurred luma is then replaced by the denoised one
+            ksize = noise_chroma_ksize(delta, scale)
+            cv2.GaussianBlur(ycrcb, (ksize, ksize), 0, dst=ycrcb)
+            cv2.insertChannel(denoised, ycrcb, 0)
+            return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR, dst=out)
     except Exception as e:
         print(f"Error in reduce_noise: {e}")
         return image
 
 
-def reduce_moire(image):
+def reduce_moire(image, scale=1.0, out=None):
     """Remove moire patterns (advanced filtering)."""
     try:
         print("Reducing moire patterns.")
-        return cv2.GaussianBlur(image, (9, 9), 0)
+        ksize = scale_ksize(9, scale)
+        return cv2.GaussianBlur(image, (ksize, ksize), 0, dst=out)
     except Exception as e:
         print(f"Error in reduce_moire: {e}")
         return image
 
 
-def defringe(image, delta):
+def defringe(image, delta, scale=1.0, out=None):
     """Defringe by adjusting color fringes."""
     try:
         print(f"Defringing with delta: {delta}")
-        return cv2.addWeighted(image, 1.0, cv2.GaussianBlur(image, (5, 5), delta), -0.5, 128)
+        ksize = scale_ksize(5, scale)
+        with SCRATCH.borrow(image.shape, image.dtype) as blurred:
+            cv2.GaussianBlur(image, (ksize, ksize), delta * scale, dst=blurred)
+            return cv2.addWeighted(image, 1.0, blurred, -0.5, 128, dst=out)
     except Exception as e:
         print(f"Error in defringe: {e}")
-        return image
\ No newline at end of file
+        return image
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_POOL_BYTES = 512 * 1024 * 1024
+SCRATCH_POOL_BYTES = 512 * 1024 * 1024
+
+
+class BufferPool:
+    """Byte-bounded pool of reusable arrays, keyed by shape and dtype, safe to share between threads.
+
+    take() hands out a free array of the requested shape and dtype, allocating one only when none
+    is free; give() returns an array for reuse. Once a render has run, the next one with the same
+    shapes takes all its buffers from the pool. Free arrays beyond max_bytes are dropped, oldest
+    first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_POOL_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.allocations = 0
+        self.reuses = 0
+        self._free = OrderedDict()  # (shape, dtype) -> list of free arrays, least recently given first
+        self._lock = threading.Lock()
+
+    def take(self, shape, dtype=np.uint8):
+        """Return an uninitialised C-contiguous array of shape and dtype."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                if not free:
+                    del self._free[key]
+                self.nbytes -= array.nbytes
+                self.reuses += 1
+                return array
+            self.allocations += 1
+        return np.empty(key[0], dtype=key[1])
+
+    def give(self, array):
+        """Return an array taken from the pool, or any array that owns its memory, for reuse.
+
+        The caller must hold the last reference to it.
+        """
+        if array.base is not None or not array.flags.c_contiguous or not array.flags.writeable:
+            return  # Views and memory maps are not ours to reuse
+        if array.nbytes > self.max_bytes:
+            return
+        key = (array.shape, array.dtype)
+        with self._lock:
+            self._free.setdefault(key, []).append(array)
+            self._free.move_to_end(key)
+            self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes:
+                oldest_key, free = next(iter(self._free.items()))
+                self.nbytes -= free.pop(0).nbytes
+                if not free:
+                    del self._free[oldest_key]
+
+    @contextmanager
+    def borrow(self, shape, dtype=np.uint8):
+        """Lend an array for the duration of a with block, e.g. for intermediates of a calculation."""
+        array = self.take(shape, dtype)
+        try:
+            yield array
+        finally:
+            self.give(array)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self.nbytes = 0
+
+
+# Intermediates of the effects functions (colour conversions, edge maps, blur passes) are borrowed
+# from here, so they are allocated once per shape rather than on every call
+SCRATCH = BufferPool(SCRATCH_POOL_BYTES)
+
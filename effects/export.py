@@ -0,0 +1,140 @@
+import os
+import tempfile
+from collections import namedtuple
+
+import cv2
+
+from effects.recipe import plan_recipe, recipe_working_space, render_recipe
+from effects.tiling import DEFAULT_TILE_SIZE, iter_rendered_tiles
+from effects.working_space import DEFAULT_WORKING_SPACE
+from utils.tiff_writer import TiledTiffWriter
+
+# Export format -> extension of the files written in it
+EXPORT_FORMATS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp", "tiff": ".tif"}
+EXTENSION_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".tif": "tiff",
+                     ".tiff": "tiff"}
+
+# quality (1-100) applies to JPEG and WebP; compression (0-9) is the zlib level of PNG and deflate
+# TIFF, 0 writing TIFFs uncompressed
+DEFAULT_QUALITY = 92
+DEFAULT_COMPRESSION = 6
+
+# format None exports in the format of the output file's extension; max_size None keeps full size
+ExportOptions = namedtuple("ExportOptions", "format quality compression max_size",
+                           defaults=(None, DEFAULT_QUALITY, DEFAULT_COMPRESSION, None))
+
+
+def format_of(path, options=None):
+    """Return the export format for path: the options' format, else the one of its extension."""
+    if options is not None and options.format:
+        return options.format
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXTENSION_FORMATS:
+        raise ValueError(f"Cannot export to '{extension}' files. Expected one of: {', '.join(EXTENSION_FORMATS)}.")
+    return EXTENSION_FORMATS[extension]
+
+
+def validate_options(options):
+    if options.format is not None and options.format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{options.format}'. "
+                         f"Expected one of: {', '.join(EXPORT_FORMATS)}.")
+    if not 1 <= options.quality <= 100:
+        raise ValueError("Export quality must be between 1 and 100.")
+    if not 0 <= options.compression <= 9:
+        raise ValueError("Export compression must be between 0 and 9.")
+    if options.max_size is not None and options.max_size < 1:
+        raise ValueError("Export size must be at least 1 pixel.")
+
+
+def export_path(path, image_format):
+    """Return path with its extension replaced by the one of image_format."""
+    return os.path.splitext(path)[0] + EXPORT_FORMATS[image_format]
+
+
+def encode_params(image_format, options):
+    if image_format == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, options.quality]
+    if image_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, options.quality]
+    if image_format == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, options.compression]
+    return []
+
+
+def export_size(shape, max_size):
+    """Return the (width, height) an image of shape is exported at, its long edge at most max_size."""
+    height, width = shape[:2]
+    if max_size is None or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_for_export(image, max_size):
+    size = export_size(image.shape, max_size)
+    if size == (image.shape[1], image.shape[0]):
+        return image
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def open_tiff(path, shape, options, tile_size=DEFAULT_TILE_SIZE):
+    channels = shape[2] if len(shape) == 3 else 1
+    return TiledTiffWriter(path, shape[1], shape[0], channels, tile_size,
+                           "deflate" if options.compression else "none", options.compression)
+
+
+def write_image(image, path, options=ExportOptions()):
+    """Resize a rendered 8-bit image as options ask and write it to path, replacing the file atomically."""
+    validate_options(options)
+    image_format = format_of(path, options)
+    image = resize_for_export(image, options.max_size)
+    if image_format == "tiff":
+        with open_tiff(path, image.shape, options) as writer:
+            for y in range(0, image.shape[0], writer.tile_size):
+                for x in range(0, image.shape[1], writer.tile_size):
+                    writer.write_tile(y, x, writer.encode_tile(image[y:y + writer.tile_size, x:x + writer.tile_size]))
+        return path
+
+    ok, encoded = cv2.imencode(EXPORT_FORMATS[image_format], image, encode_params(image_format, options))
+    if not ok:
+        raise ValueError(f"Failed to encode image: {path}")
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(encoded.data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return path
+
+
+def stream_tiff(source, stages, path, options=ExportOptions(), tile_size=DEFAULT_TILE_SIZE, workers=1,
+                working_space=DEFAULT_WORKING_SPACE):
+    """Render the chain over source straight into a tiled TIFF at path, one tile at a time.
+
+    Tiles are rendered and compressed on the workers and written as they finish, so only a few
+    tiles are ever in memory, whatever the size of the image.
+    """
+    validate_options(options)
+    with open_tiff(path, source.shape, options, tile_size) as writer:
+        for (y, x, _, _), data in iter_rendered_tiles(source, stages, tile_size, workers, working_space,
+                                                      process=writer.encode_tile):
+            writer.write_tile(y, x, data)
+    return path
+
+
+def export_image(source, recipe, path, options=ExportOptions(), rendered=None, tile_size=DEFAULT_TILE_SIZE,
+                 workers=1):
+    """Render a recipe on source and export the result to path.
+
+    The chain is planned for the image size. Full-size TIFFs are streamed from the tiled renderer,
+    so the rendered image is never whole in memory. Anything else is rendered, unless the render is
+    passed in as rendered, then resized and encoded.
+    """
+    if format_of(path, options) == "tiff" and options.max_size is None and rendered is None:
+        return stream_tiff(source, plan_recipe(recipe, source.shape).stages, path, options, tile_size, workers,
+                           recipe_working_space(recipe))
+    if rendered is None:
+        rendered = render_recipe(source, recipe)
+    return write_image(rendered, path, options)
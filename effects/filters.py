@@ -1,6 +1,38 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
 import cv2
 import numpy as np
 
+from effects.buffers import SCRATCH
+from effects.working_space import is_float, float_stage
+
+# From this kernel radius up, apply_gaussian_blur uses stacked box passes, whose cost does not grow
+# with the radius. Below it, cv2.GaussianBlur is faster (see benchmarks/bench_blur_engines.py).
+FAST_GAUSSIAN_MIN_RADIUS = 20
+GAUSSIAN_BOX_PASSES = 3
+
+# cv2.medianBlur runs on one thread. Images at least this large are split into row strips, one per
+# OpenCV thread, so tiles from effects.tiling (already spread across cores) are left whole.
+MEDIAN_PARALLEL_MIN_PIXELS = 2 * 1024 * 1024
+
+# apply_bilateral_blur fits the guided filter on an image subsampled by this factor, and stores its
+# coefficients as fixed point with this many fractional bits before averaging them
+GUIDED_SUBSAMPLE = 2
+GUIDED_A_BITS = 12
+GUIDED_B_BITS = 4
+
+# From this intensity up, apply_bilateral_blur uses the guided filter, whose cost does not grow with
+# the radius. Below it, the half-size cv2.bilateralFilter is faster: at 6 MP on one thread it takes
+# 18 ms at intensity 1 and 34 ms at 2 against ~140 ms for the guided filter, and the two break even
+# at 3 (see benchmarks/bench_blur_engines.py). The choice ignores scale, so previews match renders.
+GUIDED_MIN_INTENSITY = 3
+
+_median_pool = None
+_median_pool_lock = threading.Lock()
+
 
 def validate_inputs(image, intensity):
     if not isinstance(image, np.ndarray):
@@ -11,45 +43,229 @@ def validate_inputs(image, intensity):
         raise ValueError("Input image is empty.")
 
 
-def apply_gaussian_blur(image, intensity):
+def scale_ksize(ksize, scale):
+    """Scale an odd kernel size to an image resized by scale, keeping it odd and at least 1."""
+    if scale == 1.0:
+        return ksize
+    return max(1, int(round(ksize * scale)) | 1)
+
+
+def gaussian_sigma(ksize):
+    """Return the sigma OpenCV derives for a Gaussian kernel of ksize when sigma is 0."""
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def gaussian_box_sizes(sigma, passes=GAUSSIAN_BOX_PASSES):
+    """Return odd box widths whose repeated application approximates a Gaussian of sigma."""
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(ideal)
+    lower -= 1 - lower % 2
+    upper = lower + 2
+    lower_count = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+                        / (-4 * lower - 4))
+    return [lower if i < lower_count else upper for i in range(passes)]
+
+
+def fast_gaussian_blur(image, sigma, passes=GAUSSIAN_BOX_PASSES, out=None):
+    """Approximate a Gaussian blur with box passes, at a cost independent of sigma.
+
+    cv2.blur keeps running sums, so each pass costs the same at any width. The passes run on
+    8.8 fixed point in uint16, which keeps the arithmetic exact and the result the same
+    whichever tile of the image it is computed on. float32 working images are blurred as they are.
+    """
+    sizes = gaussian_box_sizes(sigma, passes)
+    if is_float(image):
+        return box_passes(image, sizes, out)
+    with SCRATCH.borrow(image.shape, np.uint16) as work:
+        np.copyto(work, image)
+        work <<= 8
+        box_passes(work, sizes, work)
+        work += 128
+        work >>= 8
+        result = np.empty_like(image) if out is None else out
+        np.copyto(result, work, casting="unsafe")  # Every value fits in 8 bits again
+        return result
+
+
+def box_passes(image, sizes, out=None):
+    """Run box blurs of the given sizes one after another, the last one into out."""
+    with SCRATCH.borrow(image.shape, image.dtype) as first, SCRATCH.borrow(image.shape, image.dtype) as second:
+        for i, size in enumerate(sizes[:-1]):
+            image = cv2.blur(image, (size, size), dst=(first, second)[i % 2])
+        return cv2.blur(image, (sizes[-1], sizes[-1]), dst=out)
+
+
+def apply_gaussian_blur(image, intensity, scale=1.0, out=None):
     try:
         validate_inputs(image, intensity)
-        ksize = 2 * intensity + 3
-        return cv2.GaussianBlur(image, (ksize, ksize), 0)
+        ksize = scale_ksize(2 * intensity + 3, scale)
+        if ksize // 2 >= FAST_GAUSSIAN_MIN_RADIUS and image.dtype in (np.uint8, np.float32):
+            return fast_gaussian_blur(image, gaussian_sigma(ksize), out=out)
+        return cv2.GaussianBlur(image, (ksize, ksize), 0, dst=out)
     except Exception as e:
         print(f"Error in apply_gaussian_blur: {e}")
         return image
 
 
-def apply_median_blur(image, intensity):
+def _get_median_pool():
+    global _median_pool
+    with _median_pool_lock:
+        if _median_pool is None:
+            _median_pool = ThreadPoolExecutor(thread_name_prefix="median")
+        return _median_pool
+
+
+def parallel_median_blur(image, ksize, strips, out=None):
+    """Run cv2.medianBlur on overlapping row strips in parallel; identical to one whole-image call.
+
+    For 8-bit images and kernels above 5, OpenCV uses the constant-time histogram median of
+    Perreault and Hebert, so the cost per pixel is already flat in ksize. Each strip reads ksize // 2
+    extra rows on both sides, so only the image's own top and bottom rows see a replicated border.
+    """
+    height = image.shape[0]
+    halo = ksize // 2
+    bounds = [height * i // strips for i in range(strips + 1)]
+    if out is None:
+        out = np.empty_like(image)
+
+    def render_strip(i):
+        y0, y1 = bounds[i], bounds[i + 1]
+        top, bottom = max(0, y0 - halo), min(height, y1 + halo)
+        out[y0:y1] = cv2.medianBlur(image[top:bottom], ksize)[y0 - top:y1 - top]
+
+    list(_get_median_pool().map(render_strip, range(strips)))
+    return out
+
+
+def _median_blur(image, ksize, out=None):
+    return cv2.medianBlur(image, ksize, dst=out)
+
+
+def apply_median_blur(image, intensity, scale=1.0, out=None):
     try:
         validate_inputs(image, intensity)
-        ksize = 2 * intensity + 3
-        return cv2.medianBlur(image, ksize)
+        ksize = scale_ksize(2 * intensity + 3, scale)
+        strips = min(cv2.getNumThreads(), image.shape[0] // max(ksize, 64))
+        if image.shape[0] * image.shape[1] >= MEDIAN_PARALLEL_MIN_PIXELS and strips > 1:
+            return float_stage(parallel_median_blur)(image, ksize, strips, out=out)
+        # cv2.medianBlur takes float32 only for 3 and 5 pixel kernels, so float images are quantised
+        return float_stage(_median_blur)(image, ksize, out=out)
     except Exception as e:
         print(f"Error in apply_median_blur: {e}")
         return image
 
 
-def apply_bilateral_blur(image, intensity):
+def guided_filter(image, radius, eps, subsample=GUIDED_SUBSAMPLE, out=None):
+    """Smooth every channel of a uint8 or float32 image guided by itself, preserving edges (He et al.).
+
+    Each window is fitted with out = a * image + b, where a = var / (var + eps): flat areas get
+    the window mean and edges, whose variance exceeds eps, are kept. The fit runs on an image
+    subsampled by `subsample`, but a and b are applied to the full-resolution image, so edges stay as
+    sharp as the input. All windows are box sums, so the cost does not depend on radius; they are
+    taken over integers for uint8 images, which makes the result the same on any tile aligned to
+    `subsample`.
+    """
+    height, width = image.shape[:2]
+    padded = image
+    if height % subsample or width % subsample:
+        padded = cv2.copyMakeBorder(image, 0, -height % subsample, 0, -width % subsample, cv2.BORDER_REPLICATE)
+    small_shape = (padded.shape[0] // subsample, padded.shape[1] // subsample) + image.shape[2:]
+    size = (2 * max(1, radius // subsample) + 1,) * 2
+    inv_count = np.float32(1 / (size[0] * size[1]))
+
+    with ExitStack() as stack:
+        small = stack.enter_context(SCRATCH.borrow(small_shape, image.dtype))
+        mean, var, a, b = [stack.enter_context(SCRATCH.borrow(small_shape, np.float32)) for _ in range(4)]
+        sums, box_sums = [stack.enter_context(SCRATCH.borrow(small_shape, np.int32)) for _ in range(2)]
+        cv2.resize(padded, small_shape[1::-1], dst=small, interpolation=cv2.INTER_AREA)
+
+        if is_float(image):
+            cv2.boxFilter(small, -1, size, dst=mean)
+            np.multiply(small, small, out=a)
+            cv2.boxFilter(a, -1, size, dst=var)
+        else:
+            cv2.boxFilter(small, cv2.CV_32S, size, dst=sums, normalize=False)
+            np.copyto(mean, sums)
+            mean *= inv_count
+            with SCRATCH.borrow(small_shape, np.uint16) as squares:
+                np.copyto(squares, small)
+                squares *= squares
+                cv2.boxFilter(squares, cv2.CV_32S, size, dst=sums, normalize=False)
+            np.copyto(var, sums)
+            var *= inv_count
+        var -= np.multiply(mean, mean, out=a)
+        np.add(var, np.float32(eps), out=a)
+        np.divide(var, a, out=a)
+        np.subtract(1, a, out=b)
+        b *= mean
+
+        # Average a and b over each window, into mean and var, which are no longer needed
+        if is_float(image):
+            # Float working images need no fixed point, only 8-bit renders have to match across tiles
+            cv2.boxFilter(a, -1, size, dst=mean)
+            cv2.boxFilter(b, -1, size, dst=var)
+        else:
+            for coefficients, averaged, bits in ((a, mean, GUIDED_A_BITS), (b, var, GUIDED_B_BITS)):
+                coefficients *= 1 << bits
+                np.rint(coefficients, out=coefficients)
+                np.copyto(sums, coefficients, casting="unsafe")
+                cv2.boxFilter(sums, cv2.CV_32S, size, dst=box_sums, normalize=False)
+                np.copyto(averaged, box_sums)
+                averaged *= inv_count / (1 << bits)
+        a, b = mean, var
+
+        full_size = (padded.shape[1], padded.shape[0])
+        full_a = stack.enter_context(SCRATCH.borrow(padded.shape, np.float32))
+        full_b = stack.enter_context(SCRATCH.borrow(padded.shape, np.float32))
+        fitted = cv2.resize(a, full_size, dst=full_a)[:height, :width]
+        fitted *= image
+        fitted += cv2.resize(b, full_size, dst=full_b)[:height, :width]
+        if not is_float(image):
+            return cv2.convertScaleAbs(fitted, dst=out)
+        if out is None:
+            return fitted.copy()
+        np.copyto(out, fitted)
+        return out
+
+
+def apply_bilateral_blur(image, intensity, scale=1.0, engine="auto", out=None):
     try:
         validate_inputs(image, intensity)
-        scale_factor = 0.5
-        small_image = cv2.resize(image, None, fx=scale_factor, fy=scale_factor)
         ksize = 2 * intensity + 1
-        sigma_color = sigma_space = ksize * 3
-        blurred_small_image = cv2.bilateralFilter(small_image, ksize, sigma_color, sigma_space)
-        return cv2.resize(blurred_small_image, (image.shape[1], image.shape[0]))
+        sigma_color = ksize * 3
+        if engine == "auto":
+            engine = "guided" if intensity >= GUIDED_MIN_INTENSITY else "bilateral"
+        if engine == "guided":
+            return guided_filter(image, scale_ksize(ksize, scale), sigma_color * sigma_color, out=out)
+        if engine != "bilateral":
+            raise ValueError(f"Unknown bilateral engine '{engine}'.")
+
+        # Pad to even sizes so the half-size image is exactly half, as on every tile from effects.tiling
+        height, width = image.shape[:2]
+        padded = image
+        if height % 2 or width % 2:
+            padded = cv2.copyMakeBorder(image, 0, height % 2, 0, width % 2, cv2.BORDER_REPLICATE)
+        small_image = cv2.resize(padded, (padded.shape[1] // 2, padded.shape[0] // 2))
+        sigma_space = sigma_color * scale  # Colour distances do not change with image size
+        blurred_small_image = cv2.bilateralFilter(small_image, scale_ksize(ksize, scale), sigma_color, sigma_space)
+        if padded is image:
+            return cv2.resize(blurred_small_image, (width, height), dst=out)
+        result = cv2.resize(blurred_small_image, (padded.shape[1], padded.shape[0]))[:height, :width]
+        if out is None:
+            return result.copy()
+        np.copyto(out, result)
+        return out
     except Exception as e:
         print(f"Error in apply_bilateral_blur: {e}")
         return image
 
 
-def apply_box_blur(image, intensity):
+def apply_box_blur(image, intensity, scale=1.0, out=None):
     try:
         validate_inputs(image, intensity)
-        ksize = max(3, intensity * 3)
-        return cv2.blur(image, (ksize, ksize))
+        ksize = max(1, int(round(max(3, intensity * 3) * scale)))
+        # cv2.blur keeps running sums, so it already costs the same at any kernel size
+        return cv2.blur(image, (ksize, ksize), dst=out)
     except Exception as e:
         print(f"Error in apply_box_blur: {e}")
         return image
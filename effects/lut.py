@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+from effects.buffers import SCRATCH
+
+COLOUR_LUT_BAND_ROWS = 64
+# A colour table has an entry for every 24-bit BGR colour
+COLOUR_LUT_SIZE = 1 << 24
+# Nanoseconds per pixel of one gather from a colour table. Building the table runs its adjustments
+# over all COLOUR_LUT_SIZE colours (16.7 MP), plus the conversions into and out of the lattice: this
+# many nanoseconds per colour on top of the adjustments. A table built for one render only pays off
+# on images several times larger than that, e.g. ~60 MP for Highlights and Saturation.
+COLOUR_LUT_COST = 7.0
+COLOUR_LUT_BUILD_COST = 4.0
+
+# Agreement of a fused LUT with running the adjustments one by one, as checked by compare_with_chain.
+# Channel LUTs are bit-exact. Colour LUTs sample the real functions at every colour in a 4096-wide
+# lattice, which OpenCV converts to and from HSV with its vectorised code. The last width % 32
+# columns of an image's rows go through OpenCV's scalar code instead, which rounds differently, and a
+# one-step hue change moves a saturated pixel by several levels: up to 10 levels on ~0.4% of the
+# values of a 900-wide image. That is the chain disagreeing with itself (shifted by one column, it
+# differs there too), not an error of the table, so compare_with_chain measures the columns up to the
+# last multiple of CHAIN_EXACT_COLUMNS (effects.tiling aligns tiles to the same blocks) and reports
+# the rest apart. On those columns colour LUTs are bit-exact as well.
+CHAIN_EXACT_COLUMNS = 64
+CHANNEL_LUT_TOLERANCE = 0.0
+COLOUR_LUT_TOLERANCE = 0.0
+
+
+def run_steps(image, steps, out=None):
+    """Run point operations one after another, the first into out and the rest in place."""
+    source = image
+    for function, value in steps:
+        image = function(image, value, out=out)
+        if image is not source:
+            out = image  # Point operations can overwrite their own input
+    return image
+
+
+def build_channel_lut(steps):
+    """Sample a chain of per-channel point operations into one exact (1, 256, 3) lookup table.
+
+    Every step must map each channel independently of the others (gains, offsets, gamma curves).
+    """
+    ramp = np.repeat(np.arange(256, dtype=np.uint8), 3).reshape(1, 256, 3)
+    return run_steps(ramp, steps)
+
+
+def apply_channel_lut(image, lut, out=None):
+    return cv2.LUT(image, lut, dst=out)
+
+
+def build_colour_lut(steps):
+    """Sample a chain of point operations at every one of the 2**24 BGR colours.
+
+    The result is a packed uint32 table indexed by the pixel's B, G, R bytes read as one
+    little-endian word, which apply_colour_lut resolves with a single gather per pixel.
+    """
+    lattice = np.arange(COLOUR_LUT_SIZE, dtype="<u4").view(np.uint8).reshape(4096, 4096, 4)
+    mapped = run_steps(cv2.cvtColor(lattice, cv2.COLOR_BGRA2BGR), steps)
+    return cv2.cvtColor(mapped, cv2.COLOR_BGR2BGRA).view("<u4").reshape(-1)
+
+
+def apply_colour_lut(image, lut, out=None):
+    height, width = image.shape[:2]
+    with SCRATCH.borrow((height, width, 4), np.uint8) as bgra, SCRATCH.borrow((height, width), "<u4") as mapped:
+        index = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA, dst=bgra).view("<u4")[..., 0]
+        index &= 0xFFFFFF  # Drop the alpha byte cvtColor filled in
+        # np.take widens the indices to intp, so gather a band of rows at a time to keep that copy small.
+        # Every index is in range; "clip" avoids a buffered copy of the output.
+        for y in range(0, height, COLOUR_LUT_BAND_ROWS):
+            np.take(lut, index[y:y + COLOUR_LUT_BAND_ROWS], out=mapped[y:y + COLOUR_LUT_BAND_ROWS], mode="clip")
+        return cv2.cvtColor(mapped.view(np.uint8).reshape(height, width, 4), cv2.COLOR_BGRA2BGR, dst=out)
+
+
+def compare_with_chain(image, steps, per_channel):
+    """Compare the fused LUT with the sequential chain on an image at least CHAIN_EXACT_COLUMNS wide.
+
+    Returns the largest absolute difference and the fraction of values that differ in the columns
+    up to the last multiple of CHAIN_EXACT_COLUMNS, where the fraction should stay within
+    CHANNEL_LUT_TOLERANCE or COLOUR_LUT_TOLERANCE, and the fraction that differ in the columns after
+    them, where the chain rounds differently.
+    """
+    exact_width = image.shape[1] - image.shape[1] % CHAIN_EXACT_COLUMNS
+    if exact_width == 0:
+        raise ValueError(f"Compare LUTs on images at least {CHAIN_EXACT_COLUMNS} pixels wide.")
+    expected = run_steps(image, steps).astype(np.int16)
+    if per_channel:
+        fused = apply_channel_lut(image, build_channel_lut(steps))
+    else:
+        fused = apply_colour_lut(image, build_colour_lut(steps))
+    difference = np.abs(fused.astype(np.int16) - expected)
+    exact, rest = difference[:, :exact_width], difference[:, exact_width:]
+    rest_fraction = float(np.count_nonzero(rest) / rest.size) if rest.size else 0.0
+    return int(exact.max()), float(np.count_nonzero(exact) / exact.size), rest_fraction
@@ -0,0 +1,436 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache, partial
+
+import numpy as np
+
+from effects.adjustments import NOISE_ENGINES, DEFAULT_NOISE_ENGINE
+from effects.buffers import BufferPool
+from effects.lut import COLOUR_LUT_BUILD_COST, COLOUR_LUT_COST, COLOUR_LUT_SIZE, build_channel_lut, apply_channel_lut, \
+    build_colour_lut, apply_colour_lut, run_steps
+from effects.registry import OPERATIONS, operations_of_kind, noise_stage_name
+from effects.working_space import DEFAULT_WORKING_SPACE, is_float, quantise, to_working_space
+
+# The tables below are views of effects.registry, which describes every operation.
+
+# Blurs run first, in this order, all driven by the shared intensity slider
+BLUR_STAGES = {name: operation.function for name, operation in operations_of_kind("blur").items()}
+
+# Adjustments run after the blurs, in this order, each driven by its own slider
+ADJUSTMENT_STAGES = {name: operation.function for name, operation in operations_of_kind("adjustment").items()}
+
+# The tone curve runs among the adjustments, where the registry places it, driven by its control points
+CURVE_STAGES = {name: operation.function for name, operation in operations_of_kind("curve").items()}
+_AFTER_BLUR_STAGES = {name: operation.function for name, operation in OPERATIONS.items()
+                      if operation.kind in ("adjustment", "curve") and operation.variant_of is None}
+
+# Stage names the Noise adjustment runs under, per denoise engine
+NOISE_STAGES = {engine: noise_stage_name(engine) for engine in NOISE_ENGINES}
+
+# Stages whose kernels are sized in pixels and so must shrink with a downscaled preview proxy
+SCALED_STAGES = {name for name, operation in OPERATIONS.items() if operation.scaled}
+
+# How far, in pixels, each spatial stage reads around an output pixel. Tiled rendering pads every tile
+# by the sum of these so the tiles match a whole-image render.
+STAGE_HALOS = {name: operation.halo for name, operation in OPERATIONS.items() if operation.point is None}
+
+# Point operations map every pixel on its own, so adjacent ones can be fused into one lookup table.
+# Channel point operations also map B, G and R independently of each other.
+CHANNEL_POINT_STAGES = {name for name, operation in OPERATIONS.items() if operation.point == "channel"}
+COLOUR_POINT_STAGES = {name for name, operation in OPERATIONS.items() if operation.point == "colour"}
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+
+# Colour tables are 64 MB each; the planner asks whether one is cached, so they are kept here
+# rather than in an lru_cache
+COLOUR_LUT_CACHE_SIZE = 2
+_colour_luts = OrderedDict()  # steps -> table, least recently used first
+_colour_luts_lock = threading.Lock()
+_colour_lut_builds = {}  # steps -> lock held while that table is built, so tile threads build it once
+
+
+def build_stages(active_filters, intensity, adjustments, scale=1.0, fuse=True, noise_engine=DEFAULT_NOISE_ENGINE,
+                 curve=None):
+    """Return the ordered (name, function, value) stages for the current controls.
+
+    A scale below 1.0 targets a downscaled proxy: pixel-sized kernels are shrunk by the same factor
+    so the proxy looks like a downscaled full-resolution render. With fuse, runs of adjacent point
+    adjustments are merged into a single lookup table stage. noise_engine picks the NOISE_ENGINES
+    entry the Noise adjustment runs with. curve, if given, is the [(input, output), ...] control
+    points of the tone curve.
+    """
+    stages = []
+    for name, function in BLUR_STAGES.items():
+        if active_filters.get(name):
+            stages.append((name, _scaled(name, function, scale), intensity))
+    for name, function in _AFTER_BLUR_STAGES.items():
+        if name in CURVE_STAGES:
+            value = tuple(tuple(point) for point in curve) if curve else 0
+        else:
+            value = adjustments.get(name, 0)
+        if value != 0:  # Zero means the adjustment is off
+            if name == "Noise" and noise_engine != DEFAULT_NOISE_ENGINE:
+                name = NOISE_STAGES[noise_engine]
+                function = OPERATIONS[name].function
+            stages.append((name, _scaled(name, function, scale), value))
+    return fuse_point_stages(stages) if fuse else stages
+
+
+def is_merged(name, value):
+    """Return whether a stage runs several operations, holding the (name, value) of each part."""
+    return name not in OPERATIONS and isinstance(value, tuple)
+
+
+def stage_halo(name, value):
+    """Return the halo a stage needs, 0 for point adjustments.
+
+    Merged stages, such as fused point stages, hold the (name, value) of each part they run, and
+    need the sum of the parts' halos.
+    """
+    if is_merged(name, value):
+        return sum(stage_halo(part, part_value) for part, part_value in value)
+    if name in STAGE_HALOS:
+        return STAGE_HALOS[name](value)
+    if name in CHANNEL_POINT_STAGES or name in COLOUR_POINT_STAGES:
+        return 0
+    raise ValueError(f"Unknown stage '{name}'.")
+
+
+def is_point_stage(stage):
+    """Return whether a stage maps every pixel on its own, so it can overwrite its input in place."""
+    name, _, value = stage
+    if is_merged(name, value):
+        return all(is_point_stage((part, None, part_value)) for part, part_value in value)
+    return name in CHANNEL_POINT_STAGES or name in COLOUR_POINT_STAGES
+
+
+def fuse_point_stages(stages):
+    """Replace every run of two or more adjacent point adjustments with one apply_point_ops stage."""
+    fused = []
+    run = []
+    for stage in stages + [None]:
+        if stage is not None and (stage[0] in CHANNEL_POINT_STAGES or stage[0] in COLOUR_POINT_STAGES):
+            run.append(stage)
+            continue
+        if len(run) > 1:
+            steps = tuple((name, value) for name, _, value in run)
+            fused.append(("+".join(name for name, _ in steps), apply_point_ops, steps))
+        else:
+            fused.extend(run)
+        run = []
+        if stage is not None:
+            fused.append(stage)
+    return fused
+
+
+def apply_point_ops(image, steps, colour_lut=None, out=None):
+    """Apply a run of (name, value) point adjustments in a single lookup table pass.
+
+    colour_lut forces the colour table on or off; by default use_colour_lut decides.
+    Tiled renders pass the decision made for the whole image so every tile matches it. float32
+    working images run the adjustments one by one instead, as the tables are sampled at 8 bits.
+    """
+    try:
+        if is_float(image):
+            return run_steps(image, _resolve_steps(steps), out)
+        if all(name in CHANNEL_POINT_STAGES for name, _ in steps):
+            return apply_channel_lut(image, _channel_lut(steps), out)
+        if colour_lut is None:
+            colour_lut = use_colour_lut(steps, image.shape[0] * image.shape[1])
+        if colour_lut:
+            return apply_colour_lut(image, _colour_lut(steps), out)
+        return run_steps(image, _resolve_steps(steps), out)
+    except Exception as e:
+        print(f"Error in apply_point_ops: {e}")
+        return image
+
+
+def _resolve_steps(steps):
+    return [(OPERATIONS[name].function, value) for name, value in steps]
+
+
+@lru_cache(maxsize=32)
+def _channel_lut(steps):
+    return build_channel_lut(_resolve_steps(steps))
+
+
+def colour_lut_build_cost(steps):
+    """Return the estimated nanoseconds building the colour table of a run of point adjustments takes."""
+    return (COLOUR_LUT_BUILD_COST + sum(OPERATIONS[name].cost for name, _ in steps)) * COLOUR_LUT_SIZE
+
+
+def use_colour_lut(steps, pixels):
+    """Return whether a colour table is quicker than running the adjustments one by one on pixels.
+
+    A cached table only costs its lookup. Otherwise it has to be built first, which only pays off on
+    images much larger than the table.
+    """
+    separate = sum(OPERATIONS[name].cost for name, _ in steps) * pixels
+    if has_colour_lut(steps):
+        return COLOUR_LUT_COST * pixels < separate
+    return COLOUR_LUT_COST * pixels + colour_lut_build_cost(steps) < separate
+
+
+def has_colour_lut(steps):
+    """Return whether the colour table of a run of (name, value) point adjustments is already built."""
+    with _colour_luts_lock:
+        return steps in _colour_luts
+
+
+def _cached_colour_lut(steps):
+    with _colour_luts_lock:
+        lut = _colour_luts.get(steps)
+        if lut is not None:
+            _colour_luts.move_to_end(steps)
+        return lut
+
+
+def _colour_lut(steps):
+    lut = _cached_colour_lut(steps)
+    if lut is not None:
+        return lut
+    with _colour_luts_lock:
+        building = _colour_lut_builds.setdefault(steps, threading.Lock())
+    with building:
+        lut = _cached_colour_lut(steps)  # Built by another thread while this one waited
+        if lut is not None:
+            return lut
+        try:
+            print(f"Building colour lookup table for {steps}")
+            lut = build_colour_lut(_resolve_steps(steps))
+            with _colour_luts_lock:
+                _colour_luts[steps] = lut
+                while len(_colour_luts) > COLOUR_LUT_CACHE_SIZE:
+                    _colour_luts.popitem(last=False)
+        finally:
+            with _colour_luts_lock:
+                _colour_lut_builds.pop(steps, None)
+    return lut
+
+
+def _scaled(name, function, scale):
+    if scale == 1.0 or name not in SCALED_STAGES:
+        return function
+    return partial(function, scale=scale)
+
+
+def stage_keys(stages, source_key):
+    """Return one cache key per stage, each chaining the key of the stage before it."""
+    keys = []
+    key = source_key
+    for name, _, value in stages:
+        key = (key, name, value)
+        keys.append(key)
+    return keys
+
+
+class _CacheEntry:
+    __slots__ = ("image", "shared", "pins")
+
+    def __init__(self, image, shared):
+        self.image = image
+        self.shared = shared  # Handed out of the cache, so others may hold it for as long as they like
+        self.pins = 0  # Renders reading it right now
+
+
+class PipelineCache:
+    """Byte-bounded LRU cache of intermediate stage outputs, safe to share with a render thread.
+
+    Evicted outputs go to buffers, the BufferPool run_pipeline takes new stage outputs from, so once
+    the cache is full a render reuses the memory it evicts. Only outputs the cache still owns are
+    reused: an output handed out by get() or returned by run_pipeline is shared from then on, and
+    one a render is reading stays pinned until it is done, so neither is ever overwritten.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, buffers=None):
+        self.max_bytes = max_bytes
+        self.buffers = BufferPool() if buffers is None else buffers
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """Return the output cached under key, or None. It is the caller's to keep and is never reused."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry.shared = True
+            return entry.image
+
+    def touch(self, key):
+        """Mark key as recently used without handing out its output."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def put(self, key, image, shared=True):
+        """Cache image under key. With shared=False the caller gives up the array to the cache."""
+        self._release(self._store(key, image, shared))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _acquire(self, key):
+        """Return the entry under key pinned, so it is not reused while it is read, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.pins += 1
+            return entry
+
+    def _store(self, key, image, shared):
+        """Cache image under key and return its entry pinned, or None if it is too large to cache."""
+        if image.nbytes > self.max_bytes:
+            return None  # Never worth evicting everything for one oversized entry
+        entry = _CacheEntry(image, shared)
+        entry.pins = 1
+        with self._lock:
+            if key in self._entries:
+                replaced = self._entries.pop(key)
+                self.nbytes -= replaced.image.nbytes
+                if replaced.image is not image:
+                    self._recycle(replaced)
+            self._entries[key] = entry
+            self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.image.nbytes
+                self._recycle(evicted)
+        return entry
+
+    def _release(self, entry, shared=False):
+        """Unpin an entry from _acquire or _store, marking it shared if its output is being handed out."""
+        if entry is None:
+            return
+        with self._lock:
+            entry.pins -= 1
+            entry.shared = entry.shared or shared
+
+    def _recycle(self, entry):
+        # Entries evicted while pinned are dropped; the render reading them keeps them alive
+        if not entry.shared and entry.pins == 0:
+            self.buffers.give(entry.image)
+
+
+def run_pipeline(source, stages, cache=None, source_key="source", is_cancelled=None, run_stage=None,
+                 working_space=DEFAULT_WORKING_SPACE, buffers=None):
+    """Run the stages over the source, resuming from the deepest cached stage output.
+
+    is_cancelled is polled between stages; when it returns True the run stops and returns None.
+    Stage outputs finished before the cancellation stay cached for the next run. run_stage, if
+    given, is called as run_stage(image, stage, out) in place of each stage function, e.g. to split
+    it into tiles. With the "float32" working space, the source is converted once, the stages pass
+    float images along unclipped, and only the result is quantised back to 8 bits.
+
+    Stage outputs are written into arrays taken from buffers, a BufferPool, which defaults to the
+    cache's. Without a cache, point stages run in place and every intermediate goes back to the
+    pool once the next stage has read it, so repeated renders of one size allocate nothing large.
+    """
+    if run_stage is None:
+        run_stage = _run_stage
+    if buffers is None and cache is not None:
+        buffers = cache.buffers
+    if working_space != DEFAULT_WORKING_SPACE:
+        source_key = (source_key, working_space)  # Float stage outputs are cached apart from 8-bit ones
+
+    if cache is None:
+        result = _to_working_space(source, working_space, buffers)
+        owned = result is not source
+        for stage in stages:
+            if is_cancelled is not None and is_cancelled():
+                return None
+            out = None
+            if buffers is not None:
+                out = result if owned and is_point_stage(stage) else buffers.take(result.shape, result.dtype)
+            result, owned = _advance(result, run_stage(result, stage, out), out, owned, buffers)
+        return _finish(result, working_space, buffers, owned)
+
+    keys = stage_keys(stages, source_key)
+    held = None  # The cached entry result lives in, pinned while the run still reads it
+    try:
+        for index in range(len(keys) - 1, -1, -1):
+            held = cache._acquire(keys[index])
+            if held is not None:
+                break
+        if held is not None:
+            start = index + 1
+            result = held.image
+            owned = False
+        else:
+            start = 0
+            result = _to_working_space(source, working_space, buffers)
+            owned = result is not source
+
+        # Keep the upstream outputs warm too, they are what the next slider move resumes from
+        for key in keys[:max(start - 1, 0)]:
+            cache.touch(key)
+
+        for index in range(start, len(stages)):
+            if is_cancelled is not None and is_cancelled():
+                print("Render cancelled, a newer one is pending.")
+                return None
+            name, _, value = stages[index]
+            print(f"Running stage {name} with value: {value}")
+            # Cached outputs are never overwritten, every stage gets a buffer of its own
+            out = buffers.take(result.shape, result.dtype)
+            image = result
+            result, owned = _advance(result, run_stage(result, stages[index], out), out, owned, buffers)
+            # A stage that returned its input leaves one array under two keys, which must never be reused
+            entry = cache._store(keys[index], result, shared=result is image)
+            cache._release(held, shared=result is image)
+            held = entry
+            owned = owned and entry is None
+        result = _finish(result, working_space, buffers, owned)
+        if held is not None and result is held.image:
+            cache._release(held, shared=True)  # Handed out as it is, float results are quantised into a new array
+            held = None
+        return result
+    finally:
+        cache._release(held)
+
+
+def _advance(image, result, out, owned, buffers):
+    """Return a stage's result and whether the run owns it, giving back the buffers it is done with."""
+    if result is image:
+        if buffers is not None and out is not None and out is not image:
+            buffers.give(out)  # The stage failed or had nothing to do
+        return image, owned
+    if buffers is not None:
+        if out is not None and out is not result and out is not image:
+            buffers.give(out)
+        if owned:
+            buffers.give(image)
+    return result, True
+
+
+def _to_working_space(source, working_space, buffers):
+    if buffers is None or working_space == DEFAULT_WORKING_SPACE or is_float(source):
+        return to_working_space(source, working_space)
+    return to_working_space(source, working_space, buffers.take(source.shape, np.float32))
+
+
+def _finish(result, working_space, buffers, owned):
+    if working_space == DEFAULT_WORKING_SPACE:
+        return result
+    quantised = quantise(result, None if buffers is None else buffers.take(result.shape, np.uint8))
+    if owned and buffers is not None:
+        buffers.give(result)
+    return quantised
+
+
+def _run_stage(image, stage, out=None):
+    _, function, value = stage
+    return function(image, value, out=out)
@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+from effects.lut import COLOUR_LUT_COST
+from effects.pipeline import CHANNEL_POINT_STAGES, apply_point_ops, colour_lut_build_cost, fuse_point_stages, \
+    has_colour_lut, is_merged, use_colour_lut
+from effects.registry import OPERATIONS
+from effects.working_space import DEFAULT_WORKING_SPACE
+
+# Nanoseconds per pixel of a fused channel point stage, one cv2.LUT pass. It costs more than the
+# convertScaleAbs behind Exposure and Contrast, so fusing only those two is slower than running them.
+# Colour tables are priced by effects.pipeline, which also decides when to use one.
+CHANNEL_LUT_COST = 2.5
+
+# stages: what the plan runs; cost and original_cost: estimated seconds with and without
+# planning; rewrites: one line per change the planner made or considered
+Plan = namedtuple("Plan", "stages shape cost original_cost rewrites")
+
+
+def fuse_points(stages, pixels, notes=None):
+    """Fuse runs of adjacent point stages into one lookup table stage where that is cheaper."""
+    optimised = []
+    for stage in fuse_point_stages(stages):
+        name, function, value = stage
+        if function is not apply_point_ops:
+            optimised.append(stage)
+            continue
+        parts = [(part, OPERATIONS[part].function, part_value) for part, part_value in value]
+        separate = sum(stage_cost(part, pixels) for part in parts)
+        names = ", ".join(part for part, _ in value)
+        fused = lookup_cost(value, pixels)
+        if fused < separate:
+            optimised.append(stage)
+            if notes is not None:
+                notes.append(f"Merged {names} into one lookup table")
+        else:
+            optimised.extend(parts)
+            if notes is not None:
+                notes.append(f"Kept {names} separate: a lookup table would take "
+                             f"~{fused * 1000:.0f} ms against ~{separate * 1000:.0f} ms")
+    return optimised
+
+
+def optimise(stages, shape, notes=None, working_space=DEFAULT_WORKING_SPACE):
+    """Return the cheapest equivalent chain for an image of the given shape.
+
+    Runs of point stages are merged into one lookup table stage where that is estimated to be
+    cheaper. stages come from build_stages(..., fuse=False). Lookup tables work at 8 bits, so a
+    float32 working space keeps every stage separate.
+
+    Stages are never reordered or merged otherwise. Of the blurs only the Gaussian and box blur
+    commute, each appears once in a chain, and both already cost the same at any radius, so
+    combining them would save nothing.
+    """
+    pixels = shape[0] * shape[1]
+    if working_space != DEFAULT_WORKING_SPACE:
+        if notes is not None:
+            notes.append(f"Kept every stage separate: lookup tables round to 8 bits, "
+                         f"the {working_space} working space does not")
+        return list(stages)
+    return fuse_points(stages, pixels, notes)
+
+
+def lookup_cost(steps, pixels):
+    """Return the estimated seconds a lookup table for a run of point adjustments takes, building it included.
+
+    The colour table build is counted once per render unless the table is already cached.
+    """
+    if all(name in CHANNEL_POINT_STAGES for name, _ in steps):
+        return CHANNEL_LUT_COST * pixels * 1e-9
+    build = 0.0 if has_colour_lut(steps) else colour_lut_build_cost(steps)
+    return (COLOUR_LUT_COST * pixels + build) * 1e-9
+
+
+def stage_cost(stage, pixels):
+    """Return the estimated seconds a stage takes on an image of the given number of pixels."""
+    name, function, value = stage
+    if function is apply_point_ops:
+        if all(part in CHANNEL_POINT_STAGES for part, _ in value) or use_colour_lut(value, pixels):
+            return lookup_cost(value, pixels)
+        # apply_point_ops runs the adjustments one by one where the colour table would not pay off
+        return sum(OPERATIONS[part].cost for part, _ in value) * pixels * 1e-9
+    return OPERATIONS[name].cost * pixels * 1e-9
+
+
+def plan(stages, shape, working_space=DEFAULT_WORKING_SPACE):
+    """Optimise an unfused chain for an image of the given shape and estimate what it saves."""
+    pixels = shape[0] * shape[1]
+    rewrites = []
+    planned = optimise(stages, shape, rewrites, working_space)
+    return Plan(planned, tuple(shape[:2]), sum(stage_cost(stage, pixels) for stage in planned),
+                sum(stage_cost(stage, pixels) for stage in stages), rewrites)
+
+
+def explain(plan):
+    """Return a readable description of a plan: its rewrites, each stage and the estimated costs."""
+    height, width = plan.shape
+    lines = [f"Plan for {width}x{height} ({width * height / 1e6:.1f} MP):"]
+    for step, stage in enumerate(plan.stages, 1):
+        name, _, value = stage
+        value_text = ", ".join(f"{part}={part_value}" for part, part_value in value) if is_merged(name, value) \
+            else str(value)
+        lines.append(f"  {step}. {name} ({value_text}): ~{stage_cost(stage, width * height) * 1000:.0f} ms")
+    lines.extend(f"  * {rewrite}" for rewrite in plan.rewrites or ["No rewrites, the chain is already minimal"])
+    lines.append(f"Estimated {plan.cost * 1000:.0f} ms, {plan.original_cost * 1000:.0f} ms unplanned")
+    return "\n".join(lines)
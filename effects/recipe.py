@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+
+from effects.pipeline import BLUR_STAGES, ADJUSTMENT_STAGES, NOISE_ENGINES, DEFAULT_NOISE_ENGINE, build_stages, \
+    run_pipeline
+from effects.planner import plan
+from effects.tone import validate_curve
+from effects.working_space import DEFAULT_WORKING_SPACE, validate_working_space
+
+# Example recipe:
+# {
+#     "blurs": ["gaussian", "median"],
+#     "intensity": 5,
+#     "adjustments": {"Temperature": 20, "Contrast": -10, "Noise": 10},
+#     "noise_engine": "luma",
+#     "curve": [[0, 0], [64, 56], [192, 200], [255, 255]],
+#     "working_space": "float32"
+# }
+DEFAULT_INTENSITY = 5
+
+# A recipe saved next to an image, e.g. photo.jpg.recipe.json, holds the edits made to it
+SIDECAR_SUFFIX = ".recipe.json"
+
+
+def validate_recipe(recipe):
+    if not isinstance(recipe, dict):
+        raise TypeError("Recipe must be a JSON object.")
+    for name in recipe.get("blurs", []):
+        if name not in BLUR_STAGES:
+            raise ValueError(f"Unknown blur '{name}'. Expected one of: {', '.join(BLUR_STAGES)}.")
+    intensity = recipe.get("intensity", DEFAULT_INTENSITY)
+    if not isinstance(intensity, int) or intensity < 1:
+        raise ValueError("Recipe intensity must be a positive integer.")
+    for name, value in recipe.get("adjustments", {}).items():
+        if name not in ADJUSTMENT_STAGES:
+            raise ValueError(f"Unknown adjustment '{name}'. Expected one of: {', '.join(ADJUSTMENT_STAGES)}.")
+        if not isinstance(value, int):
+            raise ValueError(f"Adjustment '{name}' must be an integer.")
+    engine = recipe.get("noise_engine", DEFAULT_NOISE_ENGINE)
+    if engine not in NOISE_ENGINES:
+        raise ValueError(f"Unknown noise engine '{engine}'. Expected one of: {', '.join(NOISE_ENGINES)}.")
+    if "curve" in recipe:
+        curve = recipe["curve"]
+        if not isinstance(curve, list) or not all(isinstance(point, list) for point in curve):
+            raise ValueError("Recipe curve must be a list of [input, output] points.")
+        validate_curve(curve)
+    validate_working_space(recipe.get("working_space", DEFAULT_WORKING_SPACE))
+
+
+def load_recipe(path):
+    """Load and validate a recipe JSON file."""
+    with open(path, "r", encoding="utf-8") as f:
+        recipe = json.load(f)
+    validate_recipe(recipe)
+    return recipe
+
+
+def save_recipe(recipe, path):
+    """Validate a recipe and write it to path as canonical JSON, replacing the file atomically."""
+    validate_recipe(recipe)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(canonical_recipe(recipe), f, indent=4)
+            f.write("\n")
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def sidecar_path(image_path):
+    return image_path + SIDECAR_SUFFIX
+
+
+def load_sidecar(image_path):
+    """Return the recipe saved next to image_path, or None if it has none."""
+    path = sidecar_path(image_path)
+    if not os.path.exists(path):
+        return None
+    return load_recipe(path)
+
+
+def canonical_recipe(recipe):
+    """Return the recipe with its defaults filled in and the operations that are off left out.
+
+    Two recipes that render the same have the same canonical form, key order included.
+    """
+    canonical = {
+        "blurs": [name for name in BLUR_STAGES if name in recipe.get("blurs", [])],
+        "intensity": recipe.get("intensity", DEFAULT_INTENSITY),
+        "adjustments": {name: recipe["adjustments"][name] for name in ADJUSTMENT_STAGES
+                        if recipe.get("adjustments", {}).get(name, 0) != 0},
+        "noise_engine": recipe.get("noise_engine", DEFAULT_NOISE_ENGINE),
+        "working_space": recipe_working_space(recipe),
+    }
+    if recipe.get("curve"):
+        canonical["curve"] = [list(point) for point in recipe["curve"]]
+    return canonical
+
+
+def recipe_id(recipe):
+    """Return a string identifying what a recipe renders, equal for recipes that render the same."""
+    return json.dumps(canonical_recipe(recipe), sort_keys=True, separators=(",", ":"))
+
+
+def recipe_from_controls(state):
+    """Return the recipe of a GUI controls state snapshot."""
+    recipe = {
+        "blurs": [name for name, active in state["filters"].items() if active],
+        "intensity": state["intensity"],
+        "adjustments": dict(state["adjustments"]),
+        "noise_engine": state["noise_engine"],
+        "working_space": state["working_space"],
+    }
+    if state.get("curve"):
+        recipe["curve"] = [list(point) for point in state["curve"]]
+    return canonical_recipe(recipe)
+
+
+def controls_from_recipe(recipe, state):
+    """Return a copy of the controls state snapshot state, moved to the settings of recipe."""
+    state = dict(state)
+    state["filters"] = {name: name in recipe.get("blurs", []) for name in state["filters"]}
+    state["intensity"] = recipe.get("intensity", DEFAULT_INTENSITY)
+    state["adjustments"] = {name: recipe.get("adjustments", {}).get(name, 0) for name in state["adjustments"]}
+    state["noise_engine"] = recipe.get("noise_engine", DEFAULT_NOISE_ENGINE)
+    state["working_space"] = recipe_working_space(recipe)
+    state["curve"] = tuple(tuple(point) for point in recipe["curve"]) if recipe.get("curve") else None
+    return state
+
+
+def plan_recipe(recipe, shape):
+    """Return the planner's Plan for rendering a recipe on an image of the given shape."""
+    return plan(recipe_to_stages(recipe, fuse=False), shape, recipe_working_space(recipe))
+
+
+def render_recipe(image, recipe, buffers=None, run_stage=None):
+    """Render a recipe on an image without touching the image, as planned for its size."""
+    return run_pipeline(image, plan_recipe(recipe, image.shape).stages, working_space=recipe_working_space(recipe),
+                        buffers=buffers, run_stage=run_stage)
+
+
+def recipe_to_stages(recipe, scale=1.0, fuse=True):
+    """Return the pipeline stages a recipe describes, in the same order the GUI runs them."""
+    active_filters = {name: True for name in recipe.get("blurs", [])}
+    intensity = recipe.get("intensity", DEFAULT_INTENSITY)
+    return build_stages(active_filters, intensity, recipe.get("adjustments", {}), scale, fuse,
+                        noise_engine=recipe.get("noise_engine", DEFAULT_NOISE_ENGINE), curve=recipe.get("curve"))
+
+
+def recipe_working_space(recipe):
+    """Return the working space a recipe renders in, "uint8" unless it asks for "float32"."""
+    return recipe.get("working_space", DEFAULT_WORKING_SPACE)
@@ -0,0 +1,110 @@
+from collections import namedtuple
+from functools import partial
+
+from effects.filters import apply_gaussian_blur, apply_median_blur, apply_bilateral_blur, apply_box_blur
+from effects.adjustments import adjust_temperature, adjust_tint, adjust_saturation, adjust_sharpness, adjust_contrast, \
+    adjust_clarity, adjust_highlights, adjust_shadows, adjust_exposure, reduce_moire, reduce_noise, defringe, \
+    noise_chroma_ksize, NOISE_ENGINES, DEFAULT_NOISE_ENGINE
+from effects.tone import apply_blacks, apply_whites, apply_midtones, apply_curve
+
+# One entry per operation the pipeline can run:
+#   name         stage name, also the key used by recipes and cache keys
+#   kind         "blur" (toggled, driven by the shared intensity slider), "adjustment" (own slider) or
+#                "curve" (the tone curve, whose value is its ((input, output), ...) control points)
+#   function     function(image, value[, scale], out=None) returning the new image, written into out
+#                if given; point operations may be given their own input as out
+#   label        text shown in the GUI
+#   value_range  (minimum, maximum) of the slider, None without one; 0 turns an adjustment off
+#   halo         function(value) returning how far, in pixels, the operation reads around an output
+#                pixel; None for point operations
+#   point        None for spatial operations, "channel" for point operations mapping B, G and R
+#                independently, "colour" for point operations mixing channels
+#   scaled       kernels are sized in pixels, so they shrink with a downscaled preview proxy
+#   cost         rough nanoseconds per pixel on one core at a typical value, for planning
+#   variant_of   for alternative engines, the operation whose slider drives them
+Operation = namedtuple("Operation", "name kind function label value_range halo point scaled cost variant_of")
+
+# Nanoseconds per pixel of each denoise engine at strength 10
+NOISE_ENGINE_COSTS = {"nlm": 2200.0, "luma": 800.0, "fast": 320.0}
+
+
+def _blur(name, function, label, halo, cost):
+    return Operation(name, "blur", function, label, (1, 20), halo, None, True, cost, None)
+
+
+def _adjustment(name, function, halo=None, point=None, scaled=False, cost=1.0, value_range=(-100, 100),
+                variant_of=None):
+    return Operation(name, "adjustment", function, name, value_range, halo, point, scaled, cost, variant_of)
+
+
+def _curve(name, function, cost):
+    return Operation(name, "curve", function, name, None, None, "channel", False, cost, None)
+
+
+def noise_stage_name(engine):
+    """Return the stage name the Noise adjustment runs under with a NOISE_ENGINES engine.
+
+    Engines other than the default get their own names, so cached outputs and profiles of one
+    engine are never taken for another's.
+    """
+    return "Noise" if engine == DEFAULT_NOISE_ENGINE else f"Noise ({engine})"
+
+
+def _noise_halo(template_window, search_window, chroma):
+    if not chroma:
+        return lambda delta: template_window // 2 + search_window // 2  # Template window plus search window
+    return lambda delta: max(template_window // 2 + search_window // 2, noise_chroma_ksize(delta) // 2)
+
+
+def _noise_operations():
+    operations = []
+    for engine, (template_window, search_window, colour, _) in NOISE_ENGINES.items():
+        default = engine == DEFAULT_NOISE_ENGINE
+        operations.append(_adjustment(
+            noise_stage_name(engine), reduce_noise if default else partial(reduce_noise, engine=engine),
+            halo=_noise_halo(template_window, search_window, not colour), scaled=True,
+            cost=NOISE_ENGINE_COSTS[engine], value_range=(0, 100), variant_of=None if default else "Noise"))
+    return operations
+
+
+# Every operation, in the order the pipeline runs them: blurs first, then adjustments
+OPERATIONS = {operation.name: operation for operation in [
+    # ksize = 2 * intensity + 3
+    _blur('gaussian', apply_gaussian_blur, "Gaussian Blur", lambda intensity: intensity + 1, 6.0),
+    _blur('median', apply_median_blur, "Median Blur", lambda intensity: intensity + 1, 130.0),
+    # Two box passes of the guided filter, plus resampling; covers the half-size bilateral engine too
+    _blur('bilateral', apply_bilateral_blur, "Bilateral Blur", lambda intensity: 2 * (2 * intensity + 1) + 4, 33.0),
+    _blur('box', apply_box_blur, "Box Blur", lambda intensity: max(3, intensity * 3) // 2, 3.0),
+    _adjustment("Temperature", adjust_temperature, point="channel", cost=1.8),
+    _adjustment("Tint", adjust_tint, point="channel", cost=1.5),
+    _adjustment("Exposure", adjust_exposure, point="channel", cost=0.6),
+    _adjustment("Contrast", adjust_contrast, point="channel", cost=0.6),
+    _adjustment("Highlights", adjust_highlights, point="colour", cost=5.8),
+    _adjustment("Shadows", adjust_shadows, point="channel", cost=1.2),
+    # Levels: input black point, input white point and midtone gamma
+    _adjustment("Blacks", apply_blacks, point="channel", cost=1.2, value_range=(0, 100)),
+    _adjustment("Whites", apply_whites, point="channel", cost=1.2, value_range=(0, 100)),
+    _adjustment("Midtones", apply_midtones, point="channel", cost=1.2),
+    _curve("Curve", apply_curve, cost=1.2),
+    _adjustment("Clarity", adjust_clarity, halo=lambda delta: 1, cost=2.1),
+    _adjustment("Saturation", adjust_saturation, point="colour", cost=5.7),
+    _adjustment("Sharpness", adjust_sharpness, halo=lambda delta: 1, cost=3.9),
+    *_noise_operations(),
+    # Moire is a toggle, not a strength
+    _adjustment("Moire", lambda image, value, scale=1.0, out=None: reduce_moire(image, scale, out),
+                halo=lambda delta: 9 // 2, scaled=True, cost=7.1, value_range=(0, 1)),
+    _adjustment("Defringe", defringe, halo=lambda delta: 5 // 2, scaled=True, cost=4.5, value_range=(0, 100)),
+]}
+
+
+def get_operation(name):
+    """Return the registered operation called name."""
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation '{name}'. Expected one of: {', '.join(OPERATIONS)}.")
+    return OPERATIONS[name]
+
+
+def operations_of_kind(kind):
+    """Return {name: operation} for the blurs, the slider-driven adjustments or the curve, in pipeline order."""
+    return {name: operation for name, operation in OPERATIONS.items()
+            if operation.kind == kind and operation.variant_of is None}
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+
+import cv2
+import numpy as np
+
+DEFAULT_DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+DISK_CACHE_DIR_ENV = "IMAGE_BLUR_CACHE_DIR"
+
+# Part of every key: bump it whenever an operation's output changes, so results rendered by older
+# code are never served
+RENDER_CACHE_VERSION = 1
+
+# Lossless and quick to write; the cache trades some disk space for encode time
+PNG_COMPRESSION = 1
+
+# DiskRenderCache rescans its directory after this many puts even while its own running total is
+# within budget, to count what other processes sharing the directory have written
+RESCAN_EVERY_PUTS = 64
+# Once over budget, it evicts down to this fraction of it, so a full cache is not rescanned on every put
+EVICT_TO_FRACTION = 0.9
+
+_digests = {}  # id(image) -> (weak reference to image, digest), for read-only images only
+_digests_lock = threading.Lock()
+
+
+def default_cache_dir():
+    return os.environ.get(DISK_CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "image_blur")
+
+
+def source_digest(image):
+    """Return a hex digest of an image's shape, pixel type and pixels.
+
+    Read-only images, such as the originals the loader hands out, cannot change, so their digest
+    is computed once and remembered for as long as the image lives.
+    """
+    if image.flags.writeable:
+        return _hash_pixels(image)
+    with _digests_lock:
+        known = _digests.get(id(image))
+        if known is not None and known[0]() is image:
+            return known[1]
+    digest = _hash_pixels(image)
+    key = id(image)
+    with _digests_lock:
+        _digests[key] = (weakref.ref(image, lambda _: _forget_digest(key)), digest)
+    return digest
+
+
+def _forget_digest(key):
+    with _digests_lock:
+        _digests.pop(key, None)
+
+
+def _hash_pixels(image):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.shape}{image.dtype.str}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def _jsonable(value):
+    if isinstance(value, tuple):
+        return [_jsonable(part) for part in value]
+    return value
+
+
+def render_key(digest, stages, working_space):
+    """Return the cache key of rendering the source with this digest through stages.
+
+    The stages are serialised canonically by name and value, so the same chain always gives the
+    same key, whichever process or window built it. Planned chains key differently from unplanned
+    ones, which matters because fused lookup tables may round differently.
+    """
+    params = {
+        "version": RENDER_CACHE_VERSION,
+        "working_space": working_space,
+        "stages": [[name, _jsonable(value)] for name, _, value in stages],
+    }
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{digest}:{canonical}".encode()).hexdigest()
+
+
+class DiskRenderCache:
+    """Size-capped, content-addressed cache of rendered images in a directory, shared by processes.
+
+    Each result is stored as a PNG named by its render_key. Files are written to a temporary name
+    and renamed into place, so readers in other processes see a whole file or none. Reading a file
+    updates its modification time, and once the directory exceeds max_bytes the least recently
+    used files are deleted. Files deleted by another process meanwhile are simply misses.
+
+    The directory is only scanned when the running total of its size, counted from the last scan
+    plus this cache's own writes, passes max_bytes, or every RESCAN_EVERY_PUTS puts to catch up
+    with other processes. Eviction then frees down to EVICT_TO_FRACTION of max_bytes, so even a
+    full cache is scanned once per RESCAN_EVERY_PUTS puts or per tenth of max_bytes written,
+    rather than on every put.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.nbytes = None  # Size of the directory as last scanned plus our writes since, None before a scan
+        self._puts_since_scan = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        """Return the cached image for key, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)  # Mark it recently used
+        except OSError:
+            return None
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            print(f"Dropping unreadable render cache entry {path}")
+            self._remove(path)
+        return image
+
+    def put(self, key, image):
+        """Store an 8-bit image under key, then evict the least recently used entries over the budget."""
+        path = self.path(key)
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+        if not ok:
+            raise ValueError("Failed to encode the render for the cache.")
+        if encoded.nbytes > self.max_bytes:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded.data)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temporary, path)
+        except BaseException:
+            self._remove(temporary)
+            raise
+        with self._lock:
+            self._puts_since_scan += 1
+            if self.nbytes is not None:
+                self.nbytes += encoded.nbytes - replaced
+            scan = (self.nbytes is None or self.nbytes > self.max_bytes
+                    or self._puts_since_scan >= RESCAN_EVERY_PUTS)
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """Scan the directory and, if it exceeds max_bytes, delete the least recently used entries.
+
+        Entries are deleted until the directory fits in EVICT_TO_FRACTION of max_bytes.
+        """
+        entries = []
+        total = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".png"):
+                    continue  # Temporary files of writes in progress
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        target = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * EVICT_TO_FRACTION)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+        with self._lock:
+            self.nbytes = total
+            self._puts_since_scan = 0
+
+    def clear(self):
+        self.max_bytes, max_bytes = 0, self.max_bytes
+        try:
+            self.evict()
+        finally:
+            self.max_bytes = max_bytes
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Another process evicted it first
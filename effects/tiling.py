@@ -0,0 +1,253 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+
+import cv2
+import numpy as np
+
+from effects.pipeline import apply_point_ops, run_pipeline, stage_halo, use_colour_lut
+from effects.buffers import SCRATCH
+from effects.working_space import DEFAULT_WORKING_SPACE
+
+DEFAULT_TILE_SIZE = 1024
+
+# OpenCV vectorises some conversions (HSV to BGR among them) in 32-pixel blocks per row and finishes
+# the row with a scalar loop that rounds differently. Starting and ending tiles on multiples of this
+# many columns gives every pixel the same code path it gets in a whole-image render.
+TILE_COLUMN_ALIGN = 64
+
+
+def chain_halo(stages):
+    """Return the (rows, columns) padding a tile needs so every stage sees the pixels it reads.
+
+    Halos add up because each stage reads the previous stage's output around every pixel. Rows
+    are rounded up to even so tiles start on even coordinates, which keeps the half-size
+    resampling in apply_bilateral_blur aligned with a whole-image render. Columns are rounded
+    up to TILE_COLUMN_ALIGN.
+    """
+    halo = sum(stage_halo(name, value) for name, _, value in stages)
+    return halo + halo % 2, -(-halo // TILE_COLUMN_ALIGN) * TILE_COLUMN_ALIGN
+
+
+def iter_tiles(height, width, tile_size=DEFAULT_TILE_SIZE):
+    """Yield (y, x, tile_height, tile_width) for every tile covering the image, row by row."""
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield y, x, min(tile_size, height - y), min(tile_size, width - x)
+
+
+def bind_whole_image(stages, height, width):
+    """Fix the per-image choices stages would otherwise make from the size of each tile."""
+    return [
+        (name, partial(apply_point_ops, colour_lut=use_colour_lut(value, height * width)), value)
+        if function is apply_point_ops
+        else (name, function, value)
+        for name, function, value in stages
+    ]
+
+
+def render_tile(source, stages, tile, halo, working_space=DEFAULT_WORKING_SPACE, out=None):
+    """Run the chain on one halo-padded tile of source and return the unpadded result.
+
+    With out, the result is copied into it and the tile's buffers, borrowed from SCRATCH, are
+    given back for the next tile.
+    """
+    y, x, tile_height, tile_width = tile
+    halo_y, halo_x = halo
+    y0, x0 = max(0, y - halo_y), max(0, x - halo_x)
+    y1, x1 = min(source.shape[0], y + tile_height + halo_y), min(source.shape[1], x + tile_width + halo_x)
+    # Copy the padded region out of source, so memory-mapped pages are read once and tiles stay contiguous
+    buffers = None if out is None else SCRATCH
+    if buffers is None:
+        padded = np.ascontiguousarray(source[y0:y1, x0:x1])
+    else:
+        padded = buffers.take((y1 - y0, x1 - x0) + source.shape[2:], source.dtype)
+        np.copyto(padded, source[y0:y1, x0:x1])
+    result = run_pipeline(padded, stages, working_space=working_space, buffers=buffers)
+    unpadded = result[y - y0:y - y0 + tile_height, x - x0:x - x0 + tile_width]
+    if out is None:
+        return unpadded
+    np.copyto(out, unpadded)
+    if result is not padded:
+        buffers.give(result)
+    buffers.give(padded)
+    return out
+
+
+def _check_tile_size(tile_size):
+    if tile_size <= 0 or tile_size % TILE_COLUMN_ALIGN:
+        raise ValueError(f"Tile size must be a positive multiple of {TILE_COLUMN_ALIGN}.")
+
+
+def render_tiled(source, stages, out=None, tile_size=DEFAULT_TILE_SIZE, workers=1,
+                 working_space=DEFAULT_WORKING_SPACE):
+    """Render the chain over source tile by tile into out.
+
+    source and out may be memory-mapped, so peak memory follows the tile size plus halo instead
+    of the image size. Every spatial stage is given its full halo, so the result is bit-identical
+    to a whole-image run_pipeline. With more than one worker, tiles run on a thread pool; OpenCV
+    releases the GIL, so tiles render on separate cores and the result stays bit-identical. In
+    a float32 working space each tile is quantised once, as it is written to out.
+    """
+    _check_tile_size(tile_size)
+    if out is None:
+        out = np.empty_like(source)
+    height, width = source.shape[:2]
+    stages = bind_whole_image(stages, height, width)
+    halo = chain_halo(stages)
+    print(f"Rendering {width}x{height} in {tile_size}px tiles with a {halo[0]}x{halo[1]}px halo "
+          f"on {workers} worker(s)...")
+
+    def render_into(tile):
+        y, x, tile_height, tile_width = tile
+        render_tile(source, stages, tile, halo, working_space, out[y:y + tile_height, x:x + tile_width])
+
+    tiles = list(iter_tiles(height, width, tile_size))
+    if workers == 1:
+        for tile in tiles:
+            render_into(tile)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_into, tiles))
+    return out
+
+
+def iter_rendered_tiles(source, stages, tile_size=DEFAULT_TILE_SIZE, workers=1, working_space=DEFAULT_WORKING_SPACE,
+                        process=None):
+    """Yield ((y, x, tile_height, tile_width), result) for every tile of the rendered chain.
+
+    Like render_tiled, but nothing image-sized is allocated: each tile is handed over as soon as
+    it is done, in completion order, and at most two tiles per worker are in flight. process, if
+    given, is applied to each tile on its worker, e.g. to compress it, and its result is yielded
+    instead of the pixels.
+    """
+    _check_tile_size(tile_size)
+    height, width = source.shape[:2]
+    stages = bind_whole_image(stages, height, width)
+    halo = chain_halo(stages)
+
+    def render(tile):
+        result = render_tile(source, stages, tile, halo, working_space)
+        return tile, result if process is None else process(result)
+
+    tiles = iter_tiles(height, width, tile_size)
+    if workers == 1:
+        for tile in tiles:
+            yield render(tile)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for tile in tiles:
+            pending.add(pool.submit(render, tile))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def run_stage_tiled(image, stage, out=None, pool=None, tile_size=DEFAULT_TILE_SIZE):
+    """Run a single stage over image into out with its tiles spread across a thread pool.
+
+    Meant as run_pipeline's run_stage hook, so per-stage outputs can still be cached.
+    """
+    _check_tile_size(tile_size)
+    height, width = image.shape[:2]
+    stages = bind_whole_image([stage], height, width)
+    halo = chain_halo(stages)
+    if out is None or out is image:
+        out = np.empty_like(image)  # Tiles read their halo from neighbours, so they cannot overwrite them
+
+    def render_into(tile):
+        y, x, tile_height, tile_width = tile
+        render_tile(image, stages, tile, halo, out=out[y:y + tile_height, x:x + tile_width])
+
+    list(pool.map(render_into, iter_tiles(height, width, tile_size)))
+    return out
+
+
+def measure_speedup(source, stages, tile_size=DEFAULT_TILE_SIZE, worker_counts=None):
+    """Time render_tiled at increasing worker counts against one worker.
+
+    Returns a list of {"workers", "seconds", "speedup", "identical"} rows, identical meaning the
+    output matched the single-worker render bit for bit.
+    """
+    if worker_counts is None:
+        cores = os.cpu_count() or 1
+        worker_counts = sorted({1, *[2 ** i for i in range(1, cores.bit_length()) if 2 ** i < cores], cores})
+    rows = []
+    reference = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        result = render_tiled(source, stages, tile_size=tile_size, workers=workers)
+        seconds = time.perf_counter() - start
+        if reference is None:
+            reference, baseline = result, seconds
+        rows.append({"workers": workers, "seconds": seconds, "speedup": baseline / seconds,
+                     "identical": bool(np.array_equal(result, reference))})
+        print(f"{workers:3d} workers: {seconds:7.3f}s  x{baseline / seconds:.2f}")
+    return rows
+
+
+def open_memmap(path, shape, dtype=np.uint8):
+    """Create a .npy file of the given shape and map it into memory for writing."""
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+
+def load_source(path):
+    """Open an image for tiled rendering.
+
+    .npy files are memory-mapped and read tile by tile, so they can be larger than RAM. Other
+    formats have to be decoded whole by OpenCV; pass them through spill_to_memmap to free that
+    memory before rendering.
+    """
+    if path.lower().endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Failed to load image: {path}")
+    return image
+
+
+def spill_to_memmap(image, path):
+    """Copy an in-memory image to a memory-mapped .npy file and return the mapping."""
+    mapped = open_memmap(path, image.shape, image.dtype)
+    mapped[:] = image
+    mapped.flush()
+    return mapped
+
+
+def render_file_tiled(input_path, output_path, stages, tile_size=DEFAULT_TILE_SIZE, work_dir=None, workers=1,
+                      working_space=DEFAULT_WORKING_SPACE, write=None, source=None):
+    """Render an image file to output_path through memory-mapped intermediates.
+
+    A .npy output is written tile by tile straight into its final file. Other formats are
+    rendered into a temporary .npy in work_dir (the output directory by default) and encoded
+    from the mapping, so the rendered pixels live in the page cache instead of process memory.
+    write(path, image), if given, encodes the result instead of cv2.imwrite. source, if given, is
+    input_path already opened with load_source, e.g. to plan the stages for its shape.
+    """
+    if source is None:
+        source = load_source(input_path)
+    if output_path.lower().endswith(".npy"):
+        out = open_memmap(output_path, source.shape, source.dtype)
+        render_tiled(source, stages, out, tile_size, workers, working_space)
+        out.flush()
+        return output_path
+
+    work_dir = work_dir or os.path.dirname(os.path.abspath(output_path))
+    temp_path = os.path.join(work_dir, f".{os.path.basename(output_path)}.{os.getpid()}.npy")
+    try:
+        out = open_memmap(temp_path, source.shape, source.dtype)
+        render_tiled(source, stages, out, tile_size, workers, working_space)
+        if write is not None:
+            write(output_path, out)
+        elif not cv2.imwrite(output_path, out):
+            raise ValueError(f"Failed to write image: {output_path}")
+        del out
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return output_path
@@ -0,0 +1,155 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from effects.working_space import is_float
+
+# Tone curves are 256-entry tables, built with NumPy once per parameter set and kept in an LRU
+# cache, so moving a slider back and forth never rebuilds them. They are channel point operations:
+# the pipeline fuses them with their neighbours into one cv2.LUT pass.
+TONE_LUT_CACHE_SIZE = 256
+
+_LEVELS = np.arange(256, dtype=np.float64) / 255.0
+
+
+def _to_lut(curve):
+    """Truncate a float curve over 0-255 into a uint8 table, as the original gamma table did."""
+    return np.clip(curve, 0, 255).astype(np.uint8)
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def gamma_curve(gamma):
+    """Return 255 * (x / 255) ** (1 / gamma) over the 256 levels, unrounded."""
+    return _LEVELS ** (1.0 / gamma) * 255
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def gamma_lut(gamma):
+    return _to_lut(gamma_curve(gamma))
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def levels_curve(black=0, white=255, gamma=1.0, output_black=0, output_white=255):
+    """Return the levels mapping over the 256 levels, unrounded.
+
+    Inputs at or below black map to output_black and at or above white to output_white; gamma
+    bends the midtones in between, values above 1 brightening them.
+    """
+    position = np.clip((np.arange(256, dtype=np.float64) - black) / max(white - black, 1), 0, 1)
+    return output_black + position ** (1.0 / gamma) * (output_white - output_black)
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def levels_lut(black=0, white=255, gamma=1.0, output_black=0, output_white=255):
+    return _to_lut(np.rint(levels_curve(black, white, gamma, output_black, output_white)))
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def curve_points_curve(points):
+    """Return the smooth curve through ((input, output), ...) control points over the 256 levels, unrounded.
+
+    The curve is a monotone cubic (Fritsch-Carlson) wherever the points are, so it never
+    overshoots between them, and flat beyond the first and last point.
+    """
+    x = np.array([point[0] for point in points], dtype=np.float64)
+    y = np.array([point[1] for point in points], dtype=np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    if len(points) == 2:
+        return np.interp(levels, x, y)
+
+    secants = np.diff(y) / np.diff(x)
+    tangents = np.empty_like(y)
+    tangents[0], tangents[-1] = secants[0], secants[-1]
+    tangents[1:-1] = (secants[:-1] + secants[1:]) / 2
+    tangents[1:-1][secants[:-1] * secants[1:] <= 0] = 0  # Flat at local extremes
+    for i, secant in enumerate(secants):
+        if secant == 0:
+            tangents[i] = tangents[i + 1] = 0
+            continue
+        alpha, beta = tangents[i] / secant, tangents[i + 1] / secant
+        norm = alpha * alpha + beta * beta
+        if norm > 9:  # Scale the tangents back so the segment stays monotone
+            tangents[i], tangents[i + 1] = 3 * alpha / norm ** 0.5 * secant, 3 * beta / norm ** 0.5 * secant
+
+    inside = np.clip(levels, x[0], x[-1])
+    segment = np.clip(np.searchsorted(x, inside, side="right") - 1, 0, len(x) - 2)
+    width = x[segment + 1] - x[segment]
+    t = (inside - x[segment]) / width
+    t2, t3 = t * t, t * t * t
+    return ((2 * t3 - 3 * t2 + 1) * y[segment] + (t3 - 2 * t2 + t) * width * tangents[segment]
+            + (-2 * t3 + 3 * t2) * y[segment + 1] + (t3 - t2) * width * tangents[segment + 1])
+
+
+@lru_cache(maxsize=TONE_LUT_CACHE_SIZE)
+def curve_lut(points):
+    return _to_lut(np.rint(curve_points_curve(points)))
+
+
+def validate_curve(points):
+    """Raise ValueError unless points are two or more (input, output) pairs in 0-255 with rising inputs."""
+    if len(points) < 2:
+        raise ValueError("A curve needs at least two points.")
+    for point in points:
+        if len(point) != 2 or not all(isinstance(v, int) and 0 <= v <= 255 for v in point):
+            raise ValueError(f"Curve point {list(point)} must be two integers between 0 and 255.")
+    if any(b[0] <= a[0] for a, b in zip(points, points[1:])):
+        raise ValueError("Curve points must have strictly increasing inputs.")
+
+
+def apply_tone_curve(image, lut, curve, out=None):
+    """Map image through a tone table, or through the unrounded curve for float32 working images.
+
+    Float images are interpolated along the curve; values beyond 0-255 keep the curve's end levels.
+    """
+    if not is_float(image):
+        return cv2.LUT(image, lut, dst=out)
+    result = np.empty_like(image) if out is None else out
+    result[...] = np.interp(image, np.arange(256), curve)
+    return result
+
+
+def apply_blacks(image, delta, out=None):
+    """Raise the input black point of the levels to delta."""
+    try:
+        print(f"Adjusting blacks with delta: {delta}")
+        return apply_tone_curve(image, levels_lut(black=delta), levels_curve(black=delta), out)
+    except Exception as e:
+        print(f"Error in apply_blacks: {e}")
+        return image
+
+
+def apply_whites(image, delta, out=None):
+    """Lower the input white point of the levels by delta."""
+    try:
+        print(f"Adjusting whites with delta: {delta}")
+        return apply_tone_curve(image, levels_lut(white=255 - delta), levels_curve(white=255 - delta), out)
+    except Exception as e:
+        print(f"Error in apply_whites: {e}")
+        return image
+
+
+def midtones_gamma(delta):
+    """Return the levels gamma of the Midtones slider: 2 at +100, 0.5 at -100."""
+    return 2.0 ** (delta / 100.0)
+
+
+def apply_midtones(image, delta, out=None):
+    """Brighten (delta > 0) or darken the midtones with the levels gamma, leaving black and white."""
+    try:
+        print(f"Adjusting midtones with delta: {delta}")
+        gamma = midtones_gamma(delta)
+        return apply_tone_curve(image, levels_lut(gamma=gamma), levels_curve(gamma=gamma), out)
+    except Exception as e:
+        print(f"Error in apply_midtones: {e}")
+        return image
+
+
+def apply_curve(image, points, out=None):
+    """Map the image through the tone curve drawn through ((input, output), ...) points."""
+    try:
+        print(f"Applying tone curve through {len(points)} points")
+        return apply_tone_curve(image, curve_lut(points), curve_points_curve(points), out)
+    except Exception as e:
+        print(f"Error in apply_curve: {e}")
+        return image
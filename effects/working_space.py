@@ -0,0 +1,68 @@
+from functools import wraps
+
+import cv2
+import numpy as np
+
+from effects.buffers import SCRATCH
+
+# Pixel types a pipeline can run in. "float32" keeps the 0-255 scale of 8-bit images but neither
+# clips nor rounds between stages: values below 0 or above 255 carry on to the next stage, and
+# the result is quantised to 8 bits once, for display or export.
+#
+# It is not a linear-light space: values stay gamma-encoded sRGB, as in the 8-bit space, so blurs and
+# exposure act on encoded values there too. Every adjustment's slider is tuned to encoded values, and
+# a float32 render should only differ from an 8-bit one by the rounding it avoids.
+WORKING_SPACES = ("uint8", "float32")
+DEFAULT_WORKING_SPACE = "uint8"
+
+
+def validate_working_space(working_space):
+    if working_space not in WORKING_SPACES:
+        raise ValueError(f"Unknown working space '{working_space}'. Expected one of: {', '.join(WORKING_SPACES)}.")
+
+
+def is_float(image):
+    return image.dtype == np.float32
+
+
+def to_working_space(image, working_space=DEFAULT_WORKING_SPACE, out=None):
+    """Return image in the working space's pixel type, converted into out if given.
+
+    Images already in it are returned as they are.
+    """
+    validate_working_space(working_space)
+    if working_space == "float32" and not is_float(image):
+        if out is None:
+            return image.astype(np.float32)
+        np.copyto(out, image)
+        return out
+    return image
+
+
+def quantise(image, out=None):
+    """Round a float32 working image to uint8 in out, clipping it to 0-255. uint8 images pass through."""
+    if not is_float(image):
+        return image
+    # convertScaleAbs rounds and saturates, but takes the absolute value first, so negatives go to 0 before
+    with SCRATCH.borrow(image.shape, np.float32) as clipped:
+        cv2.threshold(image, 0, 0, cv2.THRESH_TOZERO, dst=clipped)
+        return cv2.convertScaleAbs(clipped, dst=out)
+
+
+def float_stage(function):
+    """Wrap an 8-bit-only OpenCV call so it also takes a float32 working image.
+
+    The float image is quantised for the call and the result converted back, into out if it is
+    passed, so only this stage is rounded to 8 bits. 8-bit images are passed straight through.
+    """
+    @wraps(function)
+    def run(image, *args, out=None, **kwargs):
+        if not is_float(image):
+            return function(image, *args, out=out, **kwargs)
+        with SCRATCH.borrow(image.shape, np.uint8) as quantised, SCRATCH.borrow(image.shape, np.uint8) as result:
+            result = function(quantise(image, quantised), *args, out=result, **kwargs)
+            if out is None:
+                return result.astype(np.float32)
+            np.copyto(out, result)
+            return out
+    return run
@@ -1,17 +1,42 @@
+import os
 import sys
+from functools import partial
+
 import cv2
 import numpy as np
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
-    QFileDialog, QSlider, QFrame, QScrollArea
+    QFileDialog, QSlider, QFrame, QScrollArea, QComboBox, QMessageBox
 )
-from PySide6.QtCore import Qt, QPropertyAnimation
-from PySide6.QtGui import QPixmap, QImage
-
-# Import the filters
-from effects.filters import apply_gaussian_blur, apply_median_blur, apply_bilateral_blur, apply_box_blur
-from effects.adjustments import adjust_temperature, adjust_tint, adjust_saturation, adjust_sharpness, adjust_contrast, \
-    adjust_clarity, adjust_highlights, adjust_shadows, adjust_exposure, reduce_moire, reduce_noise, defringe
+from PySide6.QtCore import Qt, QPropertyAnimation, QTimer
+from PySide6.QtGui import QKeySequence, QShortcut
+
+# Import the filter pipeline
+from effects.pipeline import BLUR_STAGES, NOISE_ENGINES, DEFAULT_NOISE_ENGINE, PipelineCache, build_stages
+from effects.export import DEFAULT_COMPRESSION, DEFAULT_QUALITY, EXPORT_FORMATS, ExportOptions, export_path
+from effects.planner import explain, plan
+from effects.recipe import canonical_recipe, controls_from_recipe, load_sidecar, recipe_from_controls, save_recipe, \
+    sidecar_path
+from effects.render_cache import DiskRenderCache
+from effects.registry import operations_of_kind
+from effects.working_space import DEFAULT_WORKING_SPACE
+from ui.export_worker import ExportJob, ExportWorker
+from ui.image_display import create_image_display
+from ui.load_worker import LoadWorker
+from ui.render_worker import RenderWorker
+from utils.history import EditHistory
+from utils.image_loading import load_original
+from utils.profiling import enable_json_log_from_env, format_summary
+from utils.session import ImageSession
+
+# How long the controls must stay idle before the full-resolution render replaces the preview
+FULL_RENDER_DELAY_MS = 400
+
+# Previews denoise with the fastest engine; the full render uses the engine picked in the menu
+PREVIEW_NOISE_ENGINE = "fast"
+
+# Long-edge limits offered for exports, None keeping the full size
+EXPORT_SIZES = {"Full size": None, "4096 px": 4096, "2048 px": 2048, "1024 px": 1024}
 
 
 class ImageFilterApp(QMainWindow):
@@ -25,35 +50,18 @@ class ImageFilterApp(QMainWindow):
 
         # Initialize variables
         self.image = None
-        self.original_image = None
-        self.checkpoints = []
-        self.active_filters = {
-            'gaussian': False,
-            'median': False,
-            'bilateral': False,
-            'box': False
-        }
-
-        self.active_filters.update({
-            'temperature': False, 'tint': False, 'exposure': False, 'contrast': False,
-            'highlights': False, 'shadows': False, 'clarity': False, 'saturation': False,
-            'sharpness': False, 'noise': False, 'moire': False, 'defringe': False
-        })
-
-        self.previous_adjustments = {  # Initialize with None to detect the first change
-            "Temperature": None,
-            "Tint": None,
-            "Exposure": None,
-            "Contrast": None,
-            "Highlights": None,
-            "Shadows": None,
-            "Clarity": None,
-            "Saturation": None,
-            "Sharpness": None,
-            "Noise": None,
-            "Moire": None,
-            "Defringe": None
-        }
+        self.original_image = None  # Read-only, shared by renders, previews and reset without copies
+        self.loading = False  # A newly opened image is still decoding
+        self.history = EditHistory()  # Control snapshots, re-rendered on undo/redo
+        self.full_render_job = None  # (generation, controls state) of the last full render submitted
+        self.pipeline_cache = PipelineCache()
+        self.session = None  # The opened file's folder, stepped through like a filmstrip
+        self.image_id = 0  # The session's number for the current file, so cache keys never mix two images
+        self.active_filters = {name: False for name in BLUR_STAGES}
+        self.curve = None  # Tone curve control points, set only by recipes
+
+        # Initialize with None to detect the first change
+        self.previous_adjustments = {name: None for name in operations_of_kind("adjustment")}
 
         # Main layout
         main_layout = QHBoxLayout()
@@ -101,6 +109,62 @@ class ImageFilterApp(QMainWindow):
         load_image_button.clicked.connect(self.load_image)
         menu_layout.addWidget(load_image_button)
 
+        # Filmstrip: step through the other images in the opened file's folder
+        filmstrip_layout = QHBoxLayout()
+        previous_button = QPushButton("◀")
+        previous_button.clicked.connect(lambda: self.step_image(-1))
+        next_button = QPushButton("▶")
+        next_button.clicked.connect(lambda: self.step_image(1))
+        filmstrip_layout.addWidget(previous_button)
+        filmstrip_layout.addWidget(next_button)
+        menu_layout.addLayout(filmstrip_layout)
+        self.filmstrip_label = QLabel("")
+        self.filmstrip_label.setWordWrap(True)
+        menu_layout.addWidget(self.filmstrip_label)
+        QShortcut(QKeySequence("Ctrl+Left"), self, lambda: self.step_image(-1))
+        QShortcut(QKeySequence("Ctrl+Right"), self, lambda: self.step_image(1))
+
+        # Recipes: the edits saved next to the image, or copied to every image of the folder
+        save_recipe_button = QPushButton("Save Recipe")
+        save_recipe_button.clicked.connect(self.save_current_recipe)
+        menu_layout.addWidget(save_recipe_button)
+        apply_all_button = QPushButton("Apply to All")
+        apply_all_button.clicked.connect(self.apply_recipe_to_all)
+        menu_layout.addWidget(apply_all_button)
+
+        # Export: format, encoder settings and size, then the current image or the whole folder
+        menu_layout.addWidget(QLabel("Export"))
+        self.export_format_box = QComboBox()
+        for image_format in EXPORT_FORMATS:
+            self.export_format_box.addItem(image_format)
+        menu_layout.addWidget(self.export_format_box)
+        self.export_quality_label = QLabel(f"Quality: {DEFAULT_QUALITY}")
+        menu_layout.addWidget(self.export_quality_label)
+        self.export_quality_slider = QSlider(Qt.Horizontal)
+        self.export_quality_slider.setRange(1, 100)
+        self.export_quality_slider.setValue(DEFAULT_QUALITY)
+        self.export_quality_slider.valueChanged.connect(lambda value: self.export_quality_label.setText(
+            f"Quality: {value}"))
+        menu_layout.addWidget(self.export_quality_slider)
+        self.export_compression_label = QLabel(f"Compression: {DEFAULT_COMPRESSION}")
+        menu_layout.addWidget(self.export_compression_label)
+        self.export_compression_slider = QSlider(Qt.Horizontal)
+        self.export_compression_slider.setRange(0, 9)
+        self.export_compression_slider.setValue(DEFAULT_COMPRESSION)
+        self.export_compression_slider.valueChanged.connect(lambda value: self.export_compression_label.setText(
+            f"Compression: {value}"))
+        menu_layout.addWidget(self.export_compression_slider)
+        self.export_size_box = QComboBox()
+        for label in EXPORT_SIZES:
+            self.export_size_box.addItem(label)
+        menu_layout.addWidget(self.export_size_box)
+        export_button = QPushButton("Export...")
+        export_button.clicked.connect(self.export_current)
+        menu_layout.addWidget(export_button)
+        export_all_button = QPushButton("Export All...")
+        export_all_button.clicked.connect(self.export_all)
+        menu_layout.addWidget(export_all_button)
+
         # Category Buttons
         blurs_button = QPushButton("Blurs")
         adjustments_button = QPushButton("Adjustments")
@@ -119,28 +183,23 @@ class ImageFilterApp(QMainWindow):
         blurs_menu_layout = QVBoxLayout()
         self.blurs_menu.setLayout(blurs_menu_layout)
 
-        # Filter buttons
-        self.gaussian_button = QPushButton("Gaussian Blur")
-        self.median_button = QPushButton("Median Blur")
-        self.bilateral_button = QPushButton("Bilateral Blur")
-        self.box_button = QPushButton("Box Blur")
-
-        # Set click actions for filters
-        self.gaussian_button.clicked.connect(lambda: self.toggle_filter('gaussian', self.gaussian_button))
-        self.median_button.clicked.connect(lambda: self.toggle_filter('median', self.median_button))
-        self.bilateral_button.clicked.connect(lambda: self.toggle_filter('bilateral', self.bilateral_button))
-        self.box_button.clicked.connect(lambda: self.toggle_filter('box', self.box_button))
-
-        # Add buttons to submenu layout
-        for btn in (self.gaussian_button, self.median_button, self.bilateral_button, self.box_button):
-            blurs_menu_layout.addWidget(btn)
+        # Filter buttons, one per registered blur
+        self.filter_buttons = {}
+        blur_operations = operations_of_kind("blur")
+        for name, operation in blur_operations.items():
+            btn = QPushButton(operation.label)
             btn.setCheckable(True)
+            btn.clicked.connect(lambda checked=False, n=name, b=btn: self.toggle_filter(n, b))
+            blurs_menu_layout.addWidget(btn)
+            self.filter_buttons[name] = btn
 
-        # Slider for filter intensity
+        # Slider for filter intensity, shared by every blur
         self.blur_slider = QSlider(Qt.Horizontal)
-        self.blur_slider.setRange(1, 20)
+        self.blur_slider.setRange(min(operation.value_range[0] for operation in blur_operations.values()),
+                                  max(operation.value_range[1] for operation in blur_operations.values()))
         self.blur_slider.setValue(5)
-        self.blur_slider.valueChanged.connect(self.apply_active_filters)
+        self.blur_slider.valueChanged.connect(self.update_intensity)
+        self.blur_slider.sliderReleased.connect(self.finish_slider_drag)
         blurs_menu_layout.addWidget(self.blur_slider)
 
         # Toggle blurs submenu visibility
@@ -165,31 +224,17 @@ class ImageFilterApp(QMainWindow):
         # Adjustments Sliders
         self.adjustments_sliders = {}
 
-        # Define adjustment parameters
-        adjustments = [
-            ("Temperature", -100, 100, 0),
-            ("Tint", -100, 100, 0),
-            ("Exposure", -100, 100, 0),
-            ("Contrast", -100, 100, 0),
-            ("Highlights", -100, 100, 0),
-            ("Shadows", -100, 100, 0),
-            ("Clarity", -100, 100, 0),
-            ("Saturation", -100, 100, 0),
-            ("Sharpness", -100, 100, 0),
-            ("Noise", 0, 100, 0),
-            ("Moire", 0, 1, 0),  # Treat moire as a toggle (0 or 1)
-            ("Defringe", 0, 100, 0),
-        ]
-
-        # Add sliders for each adjustment
-        for name, min_val, max_val, default in adjustments:
-            label = QLabel(name)
+        # Add sliders for each registered adjustment, all starting at 0 (off)
+        for name, operation in operations_of_kind("adjustment").items():
+            (min_val, max_val), default = operation.value_range, 0
+            label = QLabel(operation.label)
             adjustments_menu_layout.addWidget(label)
 
             slider = QSlider(Qt.Horizontal)
             slider.setRange(min_val, max_val)
             slider.setValue(default)
             slider.valueChanged.connect(lambda value, n=name: self.update_adjustment(n, value))
+            slider.sliderReleased.connect(self.finish_slider_drag)
             adjustments_menu_layout.addWidget(slider)
 
             # Label to show current value
@@ -199,6 +244,18 @@ class ImageFilterApp(QMainWindow):
             # Store the slider and value label in a dictionary
             self.adjustments_sliders[name] = (slider, value_label)
 
+            if name == "Noise":
+                # Denoise engine, with its speed and quality trade-off spelled out under it
+                self.noise_engine_box = QComboBox()
+                for engine in NOISE_ENGINES:
+                    self.noise_engine_box.addItem(engine)
+                self.noise_engine_box.setCurrentText(DEFAULT_NOISE_ENGINE)
+                self.noise_engine_label = QLabel(NOISE_ENGINES[DEFAULT_NOISE_ENGINE][3])
+                self.noise_engine_label.setWordWrap(True)
+                self.noise_engine_box.currentTextChanged.connect(self.update_noise_engine)
+                adjustments_menu_layout.addWidget(self.noise_engine_box)
+                adjustments_menu_layout.addWidget(self.noise_engine_label)
+
         # Set adjustments content into the scroll area
         self.adjustments_scroll_area.setWidget(adjustments_content)
 
@@ -210,21 +267,36 @@ class ImageFilterApp(QMainWindow):
         # Connect adjustments menu toggle
         adjustments_button.clicked.connect(self.toggle_adjustments_menu)
 
-        # Add Undo button under Adjustments category
+        # Add Undo and Redo buttons under Adjustments category
         undo_button = QPushButton("Undo")
         undo_button.clicked.connect(self.undo_last)
         menu_layout.addWidget(undo_button)
 
+        redo_button = QPushButton("Redo")
+        redo_button.clicked.connect(self.redo_last)
+        menu_layout.addWidget(redo_button)
+
+        # Render in float32 and round to 8 bits once at the end, instead of after every stage
+        self.float_button = QPushButton("32-bit Float")
+        self.float_button.setCheckable(True)
+        self.float_button.toggled.connect(self.update_working_space)
+        menu_layout.addWidget(self.float_button)
+
+        # Per-stage render timings shown in the status bar
+        self.profiler_button = QPushButton("Profiler")
+        self.profiler_button.setCheckable(True)
+        self.profiler_button.toggled.connect(self.toggle_profiler)
+        menu_layout.addWidget(self.profiler_button)
+        self.statusBar().hide()
+
         # Add both menus to the main layout
         main_layout.addWidget(toggle_button_frame)
         main_layout.addWidget(self.menu_widget)
         main_layout.addWidget(self.blurs_menu)
         main_layout.addWidget(self.adjustments_menu)
 
-        # Image display area
-        self.image_label = QLabel()
-        self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setStyleSheet("background-color: #222;")
+        # Image display area, drawn from a buffer downscaled to the viewport
+        self.image_label = create_image_display()
         main_layout.addWidget(self.image_label, 1)
 
         # Initialize animation for menu
@@ -232,6 +304,58 @@ class ImageFilterApp(QMainWindow):
         self.animation.setDuration(300)
         self.menu_open = False
 
+        # Full-resolution render deferred until the controls go idle
+        self.full_render_timer = QTimer(self)
+        self.full_render_timer.setSingleShot(True)
+        self.full_render_timer.setInterval(FULL_RENDER_DELAY_MS)
+        self.full_render_timer.timeout.connect(self.render_full_resolution)
+
+        # Filtering runs on a worker thread that only ever renders the newest controls
+        # Full renders are also kept on disk, so reopening an image with the same settings skips the chain
+        self.render_worker = RenderWorker(self.pipeline_cache, self, disk_cache=self.open_disk_cache())
+        self.render_worker.rendered.connect(self.on_render_finished)
+        self.render_worker.profiled.connect(self.on_render_profiled)
+        self.render_worker.start()
+
+        # Images decode on a worker thread too: a quick low-resolution first paint, then the original
+        self.load_worker = LoadWorker(self)
+        self.load_worker.first_paint.connect(self.on_first_paint)
+        self.load_worker.loaded.connect(self.on_image_loaded)
+        self.load_worker.failed.connect(self.on_load_failed)
+        self.load_worker.start()
+
+        # Exports encode on their own worker, several images at once, so the controls stay live
+        self.export_worker = ExportWorker(self)
+        self.export_worker.exported.connect(self.on_exported)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.start()
+
+    def open_disk_cache(self):
+        try:
+            return DiskRenderCache()
+        except OSError as e:
+            print(f"Render cache disabled: {e}")
+            return None
+
+    def toggle_profiler(self, enabled):
+        self.statusBar().setVisible(enabled)
+        if enabled:
+            self.statusBar().showMessage("Waiting for the next render...")
+
+    def on_render_profiled(self, summary):
+        if self.statusBar().isVisible():
+            self.statusBar().showMessage(format_summary(summary))
+
+    def closeEvent(self, event):
+        self.full_render_timer.stop()
+        self.render_worker.stop()
+        self.load_worker.stop()
+        self.export_worker.stop()
+        if self.session is not None:
+            self.session.close()
+        super().closeEvent(event)
+
     def toggle_blurs_menu(self):
         try:
             print("Toggling blurs menu...")
@@ -262,20 +386,21 @@ class ImageFilterApp(QMainWindow):
         try:
             print("Resetting image...")
             if self.original_image is not None:
-                self.image = self.original_image.copy()
-                self.checkpoints = [self.image.copy()]
+                self.full_render_timer.stop()
+                self.render_worker.cancel()
+                self.image = self.original_image
 
                 # Reset active filters
                 self.active_filters = {key: False for key in self.active_filters}
 
-                # Reset adjustment sliders
-                for adjustment, (slider, value_label) in self.adjustments_sliders.items():
-                    slider.setValue(0)
-                    value_label.setText("0")
-
-                # Reset filter buttons to unchecked state
-                for button in [self.gaussian_button, self.median_button, self.bilateral_button, self.box_button]:
-                    button.setChecked(False)
+                # Reset adjustment sliders and filter buttons, recorded as a single undo step
+                state = self.get_controls_state()
+                state['adjustments'] = {name: 0 for name in state['adjustments']}
+                state['curve'] = None
+                self.set_controls_state(state)
+                self.history.close_group()
+                self.history.record(state)
+                self.history.store_frame(state, self.image)
 
                 # Clear previous adjustments tracking
                 self.previous_adjustments = {key: None for key in self.previous_adjustments}
@@ -308,24 +433,241 @@ class ImageFilterApp(QMainWindow):
             print("Loading image...")
             file_name, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Image Files (*.png *.jpg *.bmp)")
             if file_name:
-                self.image = cv2.imread(file_name)
-                if self.image is None:
-                    raise ValueError("Failed to load image. Check the file format or path.")
-                self.original_image = self.image.copy()
-                self.checkpoints = [self.image.copy()]
-                print(f"Image loaded: {file_name}")
-                self.show_image(self.image)
+                self.open_session(file_name)
+        except Exception as e:
+            print(f"Error loading image: {e}")
+
+    def open_session(self, file_name):
+        """Open file_name as the current image of a session over its folder."""
+        if self.session is not None:
+            self.session.close()
+        self.session = ImageSession.from_file(file_name)
+        self.pipeline_cache.clear()
+        self.open_current()
+
+    def step_image(self, delta):
+        """Show the image delta files along in the session, keeping the current one's edits."""
+        try:
+            if self.session is None:
+                return
+            if not self.loading and self.original_image is not None:
+                self.session.states[self.session.current] = self.get_controls_state()
+            index = self.session.index
+            self.session.step(delta)
+            if self.session.index != index:
+                self.open_current()
+        except Exception as e:
+            print(f"Error stepping to another image: {e}")
+
+    def open_current(self):
+        """Show the session's current file, straight from the session if it holds the decoded original.
+
+        Otherwise it is decoded in the background; renders wait until its original has arrived.
+        """
+        path = self.session.current
+        self.full_render_timer.stop()
+        self.render_worker.cancel()
+        self.filmstrip_label.setText(f"{self.session.index + 1} / {len(self.session.paths)}\n{os.path.basename(path)}")
+        original = self.session.original(path)
+        if original is not None:
+            self.load_worker.cancel()
+            self.show_loaded(path, original)
+            return
+        self.loading = True
+        ratio = self.image_label.devicePixelRatioF()
+        self.load_worker.submit(path, (int(self.image_label.width() * ratio), int(self.image_label.height() * ratio)),
+                                decode=self.session.decode)
+
+    def on_first_paint(self, generation, file_name, image):
+        if generation != self.load_worker.generation:
+            return
+        print(f"First paint of {file_name} at {image.shape[1]}x{image.shape[0]}")
+        self.show_image(image)
+
+    def on_image_loaded(self, generation, file_name, image):
+        try:
+            if generation != self.load_worker.generation:
+                return  # Another file was opened meanwhile
+            print(f"Image loaded: {file_name}")
+            self.show_loaded(file_name, image)
         except Exception as e:
             print(f"Error loading image: {e}")
 
+    def show_loaded(self, file_name, image):
+        """Make a decoded original current, with the edits it had, and start prefetching its neighbours.
+
+        Files seen for the first time start from the recipe saved next to them, or with every filter
+        and adjustment off.
+        """
+        self.loading = False
+        self.original_image = image
+        self.image_id = self.session.image_id(file_name)
+        state = self.session.states.get(file_name)
+        if state is None:
+            state = self.initial_state(file_name)
+        self.set_controls_state(state)
+        self.previous_adjustments = {key: None for key in self.previous_adjustments}
+        self.history.reset(state)
+        self.render_worker.cancel()
+        rendered = self.session.render(file_name, state)
+        self.image = image if rendered is None else rendered
+        self.show_image(self.image)
+        edited = any(state['filters'].values()) or any(state['adjustments'].values()) or state['curve']
+        if rendered is None and edited:
+            self.apply_active_filters()
+        self.session.prefetch()
+
+    def initial_state(self, file_name):
+        """Return the controls state of the recipe saved next to file_name, or with everything off."""
+        state = self.get_controls_state()
+        try:
+            recipe = load_sidecar(file_name)
+            if recipe is not None:
+                print(f"Loaded recipe {sidecar_path(file_name)}")
+                return controls_from_recipe(recipe, state)
+        except Exception as e:
+            print(f"Error loading recipe for {file_name}: {e}")
+        return controls_from_recipe({}, state)
+
+    def save_current_recipe(self):
+        try:
+            if self.session is None or self.loading:
+                print("No image to save a recipe for.")
+                return
+            path = sidecar_path(self.session.current)
+            save_recipe(recipe_from_controls(self.get_controls_state()), path)
+            print(f"Recipe saved: {path}")
+        except Exception as e:
+            print(f"Error saving recipe: {e}")
+
+    def apply_recipe_to_all(self):
+        """Give every image of the session the current edits, saving them as each image's recipe.
+
+        Images with edits of their own, saved in a sidecar or made in this session, keep them unless
+        the user chooses to overwrite them.
+        """
+        try:
+            if self.session is None or self.loading:
+                print("No image to copy the recipe from.")
+                return
+            state = self.get_controls_state()
+            recipe = recipe_from_controls(state)
+            edited = [path for path in self.session.paths
+                      if path != self.session.current and self.has_own_edits(path, recipe)]
+            targets = self.session.paths
+            if edited:
+                answer = QMessageBox.question(
+                    self, "Apply to All",
+                    f"{len(edited)} other image(s) in this folder already have edits of their own.\n"
+                    f"Overwrite their edits too? Choose No to apply the recipe only to the unedited images.",
+                    QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.No)
+                if answer == QMessageBox.Cancel:
+                    print("Apply to All cancelled.")
+                    return
+                if answer == QMessageBox.No:
+                    targets = [path for path in targets if path not in edited]
+            for path in targets:
+                self.session.states[path] = state
+                save_recipe(recipe, sidecar_path(path))
+            print(f"Recipe applied to {len(targets)} images, {len(self.session.paths) - len(targets)} kept their own")
+        except Exception as e:
+            print(f"Error applying recipe to all images: {e}")
+
+    def has_own_edits(self, path, recipe):
+        """Return whether path has edits other than recipe, in its sidecar or in this session."""
+        state = self.session.states.get(path)
+        if state is not None:
+            edits = recipe_from_controls(state)
+            if edits == recipe:
+                return False
+            if edits != recipe_from_controls(controls_from_recipe({}, state)):
+                return True
+        try:
+            saved = load_sidecar(path)
+        except Exception as e:
+            print(f"Error reading the recipe of {path}: {e}")
+            return True  # Unreadable, but still the user's file: leave it to them
+        return saved is not None and canonical_recipe(saved) != recipe
+
+    def get_export_options(self):
+        return ExportOptions(self.export_format_box.currentText(), self.export_quality_slider.value(),
+                             self.export_compression_slider.value(),
+                             EXPORT_SIZES[self.export_size_box.currentText()])
+
+    def export_source(self, path):
+        """Return path's original from the session if it holds it, else decode it without caching it."""
+        original = self.session.original(path)
+        return original if original is not None else load_original(path)
+
+    def export_current(self):
+        """Export the current image with its edits, reusing its full render when it is finished."""
+        try:
+            if self.session is None or self.loading:
+                print("No image to export.")
+                return
+            options = self.get_export_options()
+            suggested = export_path(os.path.splitext(self.session.current)[0] + "_edited", options.format)
+            path, _ = QFileDialog.getSaveFileName(self, "Export Image", suggested,
+                                                  f"Images (*{EXPORT_FORMATS[options.format]})")
+            if not path:
+                return
+            state = self.get_controls_state()
+            original = self.original_image
+            job = ExportJob(export_path(path, options.format), lambda: original, recipe_from_controls(state), options,
+                            self.session.render(self.session.current, state))
+            self.export_worker.submit([job])
+            print(f"Exporting {job.path}...")
+        except Exception as e:
+            print(f"Error exporting image: {e}")
+
+    def export_all(self):
+        """Export every image of the session with its own edits into a folder.
+
+        Images not opened yet are exported with the recipe saved next to them, if any.
+        """
+        try:
+            if self.session is None or self.loading:
+                print("No images to export.")
+                return
+            directory = QFileDialog.getExistingDirectory(self, "Export All Images To")
+            if not directory:
+                return
+            options = self.get_export_options()
+            self.session.states[self.session.current] = self.get_controls_state()
+            jobs = []
+            for path in self.session.paths:
+                state = self.session.states.get(path) or self.initial_state(path)
+                output_path = os.path.join(directory, export_path(os.path.basename(path), options.format))
+                if os.path.abspath(output_path) == os.path.abspath(path):
+                    print(f"Skipping {path}: exporting it would overwrite the original")
+                    continue
+                jobs.append(ExportJob(output_path, partial(self.export_source, path), recipe_from_controls(state),
+                                      options, self.session.render(path, state)))
+            self.export_worker.submit(jobs)
+            print(f"Exporting {len(jobs)} images to {directory}...")
+        except Exception as e:
+            print(f"Error exporting images: {e}")
+
+    def on_exported(self, batch, path):
+        print(f"Exported {path}")
+
+    def on_export_failed(self, batch, path, message):
+        print(f"Error exporting {path}: {message}")
+
+    def on_export_progress(self, batch, done, total):
+        if done == total:
+            print(f"Export finished: {total} image(s)")
+
+    def on_load_failed(self, generation, file_name, message):
+        if generation != self.load_worker.generation:
+            return
+        self.loading = False
+        print(f"Error loading image {file_name}: {message}")
+
     def show_image(self, img):
         try:
             print("Displaying image...")
-            height, width, channel = img.shape
-            bytes_per_line = 3 * width
-            q_img = QImage(img.data, width, height, bytes_per_line, QImage.Format_BGR888)
-            pixmap = QPixmap.fromImage(q_img)
-            self.image_label.setPixmap(pixmap.scaled(self.image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+            self.image_label.show_frame(img)
         except Exception as e:
             print(f"Error displaying image: {e}")
 
@@ -334,91 +676,208 @@ class ImageFilterApp(QMainWindow):
             print(f"Toggling filter: {filter_name}")
             self.active_filters[filter_name] = not self.active_filters[filter_name]
             button.setChecked(self.active_filters[filter_name])
+            self.history.close_group()
+            self.history.record(self.get_controls_state())
             self.apply_active_filters()
         except Exception as e:
             print(f"Error toggling filter {filter_name}: {e}")
 
-    def apply_active_filters(self):
+    def get_controls_state(self):
+        """Snapshot every control that affects the render."""
+        return {
+            'filters': {name: self.active_filters[name] for name in BLUR_STAGES},
+            'intensity': self.blur_slider.value(),
+            'adjustments': {name: slider.value() for name, (slider, _) in self.adjustments_sliders.items()},
+            'noise_engine': self.noise_engine_box.currentText(),
+            'working_space': self.get_working_space(),
+            'curve': self.curve,
+        }
+
+    def set_controls_state(self, state):
+        """Move every control to a snapshot without triggering renders."""
+        for name, active in state['filters'].items():
+            self.active_filters[name] = active
+            self.filter_buttons[name].setChecked(active)
+
+        self.blur_slider.blockSignals(True)
+        self.blur_slider.setValue(state['intensity'])
+        self.blur_slider.blockSignals(False)
+
+        for name, value in state['adjustments'].items():
+            slider, value_label = self.adjustments_sliders[name]
+            slider.blockSignals(True)
+            slider.setValue(value)
+            slider.blockSignals(False)
+            value_label.setText(f"{value}")
+
+        self.noise_engine_box.blockSignals(True)
+        self.noise_engine_box.setCurrentText(state['noise_engine'])
+        self.noise_engine_box.blockSignals(False)
+        self.noise_engine_label.setText(NOISE_ENGINES[state['noise_engine']][3])
+
+        self.float_button.blockSignals(True)
+        self.float_button.setChecked(state['working_space'] == "float32")
+        self.float_button.blockSignals(False)
+
+        self.curve = state['curve']
+
+    def get_working_space(self):
+        return "float32" if self.float_button.isChecked() else DEFAULT_WORKING_SPACE
+
+    def update_intensity(self, value):
+        try:
+            print(f"Updating blur intensity to {value}")
+            self.history.record(self.get_controls_state(), group='intensity')
+            self.schedule_render()
+        except Exception as e:
+            print(f"Error updating blur intensity: {e}")
+
+    def update_noise_engine(self, engine):
+        try:
+            print(f"Switching noise engine to {engine}")
+            self.noise_engine_label.setText(NOISE_ENGINES[engine][3])
+            self.history.close_group()
+            self.history.record(self.get_controls_state())
+            self.apply_active_filters()
+        except Exception as e:
+            print(f"Error switching noise engine: {e}")
+
+    def update_working_space(self, enabled):
+        try:
+            print(f"Switching working space to {self.get_working_space()}")
+            self.history.close_group()
+            self.history.record(self.get_controls_state())
+            self.apply_active_filters()
+        except Exception as e:
+            print(f"Error switching working space: {e}")
+
+    def finish_slider_drag(self):
+        # A drag is one undo step however many values it passed through
+        self.history.close_group()
+        self.render_full_resolution()
+
+    def schedule_render(self):
+        try:
+            # Show a quick proxy preview now and replace it once the controls go idle
+            self.apply_active_filters(preview=True)
+            self.full_render_timer.start()
+        except Exception as e:
+            print(f"Error scheduling render: {e}")
+
+    def render_full_resolution(self):
+        try:
+            self.full_render_timer.stop()
+            self.apply_active_filters()
+        except Exception as e:
+            print(f"Error rendering full resolution: {e}")
+
+    def get_preview_source(self):
+        """Return the original downscaled to the display size, and the scale factor used."""
+        height, width = self.original_image.shape[:2]
+        scale = min(self.image_label.width() / width, self.image_label.height() / height, 1.0)
+        if scale >= 1.0:
+            return self.original_image, 1.0
+
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        preview = self.session.preview(self.session.current, size)
+        if preview is None:
+            print(f"Building preview proxy at {size[0]}x{size[1]}")
+            preview = cv2.resize(self.original_image, size, interpolation=cv2.INTER_AREA)
+            self.session.store_preview(self.session.current, size, preview)
+        return preview, size[0] / width
+
+    def apply_active_filters(self, preview=False):
         try:
             print("Applying active filters...")
-            if self.image is not None:
-                # Start with the original image to prevent accumulating changes
-                current_image = self.original_image.copy()
-
-                # Apply active blur filters
-                intensity = self.blur_slider.value()
-                if self.active_filters['gaussian']:
-                    current_image = apply_gaussian_blur(current_image, intensity)
-                if self.active_filters['median']:
-                    current_image = apply_median_blur(current_image, intensity)
-                if self.active_filters['bilateral']:
-                    current_image = apply_bilateral_blur(current_image, intensity)
-                if self.active_filters['box']:
-                    current_image = apply_box_blur(current_image, intensity)
-
-                # Apply adjustments cumulatively based on the sliders' values
-                for adjustment, (slider, _) in self.adjustments_sliders.items():
-                    value = slider.value()
-
-                    # Apply the corresponding adjustment
-                    if value != 0:  # Skip adjustments with zero values
-                        print(f"Applying {adjustment} with value: {value}")
-                        if adjustment == "Temperature":
-                            current_image = adjust_temperature(current_image, value)
-                        elif adjustment == "Tint":
-                            current_image = adjust_tint(current_image, value)
-                        elif adjustment == "Exposure":
-                            current_image = adjust_exposure(current_image, value)
-                        elif adjustment == "Contrast":
-                            current_image = adjust_contrast(current_image, value)
-                        elif adjustment == "Highlights":
-                            current_image = adjust_highlights(current_image, value)
-                        elif adjustment == "Shadows":
-                            current_image = adjust_shadows(current_image, value)
-                        elif adjustment == "Clarity":
-                            current_image = adjust_clarity(current_image, value)
-                        elif adjustment == "Saturation":
-                            current_image = adjust_saturation(current_image, value)
-                        elif adjustment == "Sharpness":
-                            current_image = adjust_sharpness(current_image, value)
-                        elif adjustment == "Noise":
-                            current_image = reduce_noise(current_image, value)
-                        elif adjustment == "Moire" and value > 0:
-                            current_image = reduce_moire(current_image)
-                        elif adjustment == "Defringe":
-                            current_image = defringe(current_image, value)
-
-                # Update the displayed image
-                self.image = current_image
-                self.checkpoints.append(current_image.copy())
-                self.show_image(current_image)
+            if self.image is not None and not self.loading:
+                adjustments = {name: slider.value() for name, (slider, _) in self.adjustments_sliders.items()}
+                if preview:
+                    # Run the same chain on the display-sized proxy, kernels scaled to match
+                    source, scale = self.get_preview_source()
+                    stages = build_stages(self.active_filters, self.blur_slider.value(), adjustments, scale,
+                                          fuse=False, noise_engine=PREVIEW_NOISE_ENGINE, curve=self.curve)
+                    stages = plan(stages, source.shape, self.get_working_space()).stages
+                    self.render_worker.submit(source, stages, ("preview", self.image_id, source.shape), preview=True,
+                                              working_space=self.get_working_space())
+                    return
+
+                # Start from the original image to prevent accumulating changes, reusing cached
+                # stage outputs so only the stages downstream of the changed control rerun
+                stages = build_stages(self.active_filters, self.blur_slider.value(), adjustments,
+                                      fuse=False, noise_engine=self.noise_engine_box.currentText(), curve=self.curve)
+                execution_plan = plan(stages, self.original_image.shape, self.get_working_space())
+                if self.profiler_button.isChecked():
+                    print(explain(execution_plan))
+                stages = execution_plan.stages
+                generation = self.render_worker.submit(self.original_image, stages, ("source", self.image_id),
+                                                       working_space=self.get_working_space())
+                self.full_render_job = (generation, self.get_controls_state())
         except Exception as e:
             print(f"Error applying filters: {e}")
 
+    def on_render_finished(self, generation, preview, current_image):
+        try:
+            if generation != self.render_worker.generation:
+                return  # Superseded while the result was queued for the GUI thread
+            if not preview:
+                # Update the current image and let the history keep it while it fits the budget
+                self.image = current_image
+                if self.full_render_job is not None and self.full_render_job[0] == generation:
+                    self.history.store_frame(self.full_render_job[1], current_image)
+                    self.session.store_render(self.session.current, self.full_render_job[1], current_image)
+            self.show_image(current_image)
+        except Exception as e:
+            print(f"Error showing rendered image: {e}")
+
     def update_adjustment(self, adjustment, value):
         try:
             print(f"Updating adjustment: {adjustment} with value {value}")
             slider, value_label = self.adjustments_sliders[adjustment]
             value_label.setText(f"{value}")
-            self.apply_active_filters()
+            self.history.record(self.get_controls_state(), group=adjustment)
+            self.schedule_render()
         except Exception as e:
             print(f"Error updating adjustment {adjustment}: {e}")
 
     def undo_last(self):
         try:
             print("Undoing last action...")
-            if len(self.checkpoints) > 1:
-                self.checkpoints.pop()  # Remove the current state
-                self.image = self.checkpoints[-1].copy()  # Revert to the previous state
-                self.show_image(self.image)
+            step = self.history.undo()
+            if step is not None:
+                self.show_history_step(*step)
             else:
                 print("No more actions to undo.")
         except Exception as e:
             print(f"Error undoing last action: {e}")
 
+    def redo_last(self):
+        try:
+            print("Redoing last action...")
+            step = self.history.redo()
+            if step is not None:
+                self.show_history_step(*step)
+            else:
+                print("No more actions to redo.")
+        except Exception as e:
+            print(f"Error redoing last action: {e}")
+
+    def show_history_step(self, state, frame):
+        self.full_render_timer.stop()
+        self.render_worker.cancel()
+        self.set_controls_state(state)
+        if self.image is None:
+            return
+        if frame is not None:
+            self.image = frame
+            self.show_image(frame)
+        else:
+            # The frame was dropped to stay within the history budget, render the snapshot again
+            self.apply_active_filters()
+
 
 # Main loop to run the application
 if __name__ == "__main__":
+    enable_json_log_from_env()
     app = QApplication(sys.argv)
     window = ImageFilterApp()
     window.show()
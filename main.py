@@ -1,8 +1,10 @@
 import sys
 from PySide6.QtWidgets import QApplication
 from ui.main_window import ImageFilterApp
+from utils.profiling import enable_json_log_from_env
 
 if __name__ == "__main__":
+    enable_json_log_from_env()
     app = QApplication(sys.argv)
     window = ImageFilterApp()
     window.show()
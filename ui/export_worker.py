@@ -0,0 +1,79 @@
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PySide6.QtCore import QThread, Signal
+
+from effects.export import ExportOptions, export_image
+
+# One image to export: load() returns its source, rendered is its finished render if one is at hand
+ExportJob = namedtuple("ExportJob", "path load recipe options rendered", defaults=(ExportOptions(), None))
+
+
+def run_export_job(job, tile_workers=1):
+    return export_image(job.load(), job.recipe, job.path, job.options, job.rendered, workers=tile_workers)
+
+
+class ExportWorker(QThread):
+    """Exports images off the GUI thread, the images of one export encoded in parallel.
+
+    Exports run one after another in the order they were submitted, and unlike renders they are
+    never superseded. The images of an export are decoded, rendered and encoded on a thread pool,
+    since OpenCV and zlib release the GIL; an export of a single image spreads its TIFF tiles over
+    the pool instead.
+    """
+
+    # export number, path written
+    exported = Signal(int, str)
+    # export number, path, error message
+    failed = Signal(int, str, str)
+    # export number, images done, images in the export
+    progress = Signal(int, int, int)
+
+    def __init__(self, parent=None, workers=None):
+        super().__init__(parent)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch = 0
+        self._queue = deque()
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    def submit(self, jobs):
+        """Queue an export of a list of ExportJobs and return its number."""
+        with self._condition:
+            self.batch += 1
+            self._queue.append((self.batch, list(jobs)))
+            self._condition.notify()
+            return self.batch
+
+    def stop(self):
+        """Finish the images being exported, drop the rest and wait for the thread to end."""
+        with self._condition:
+            self._stopping = True
+            self._queue.clear()
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._stopping:
+                        self._condition.wait()
+                    if self._stopping:
+                        return
+                    batch, jobs = self._queue.popleft()
+
+                tile_workers = self.workers if len(jobs) == 1 else 1
+                futures = {pool.submit(run_export_job, job, tile_workers): job for job in jobs}
+                for done, future in enumerate(as_completed(futures), 1):
+                    try:
+                        self.exported.emit(batch, future.result())
+                    except Exception as e:
+                        self.failed.emit(batch, futures[future].path, str(e))
+                    self.progress.emit(batch, done, len(jobs))
+                    if self._stopping:
+                        for pending in futures:
+                            pending.cancel()
+                        return
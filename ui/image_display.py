@@ -1,10 +1,87 @@
+import cv2
+import numpy as np
 from PySide6.QtWidgets import QLabel
 from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QPainter
+
+
+class DisplayBuffer:
+    """Persistent BGR buffer holding the current frame downscaled to fit the viewport.
+
+    The downscale happens in OpenCV before anything reaches Qt, so the cost of showing a frame
+    follows the screen size, not the image size. The buffer and the QImage wrapping its memory are
+    only reallocated when the fitted size changes.
+    """
+
+    def __init__(self):
+        self.array = None
+        self.qimage = None
+
+    def fitted_size(self, frame, width, height):
+        """Return the (width, height) frame scales to inside width x height, never enlarged."""
+        frame_height, frame_width = frame.shape[:2]
+        scale = min(width / frame_width, height / frame_height, 1.0)
+        return max(1, round(frame_width * scale)), max(1, round(frame_height * scale))
+
+    def update(self, frame, width, height):
+        """Draw frame into the buffer at its fitted size and return the QImage viewing it."""
+        size = self.fitted_size(frame, width, height)
+        if self.array is None or self.array.shape[1::-1] != size:
+            self.array = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.qimage = QImage(self.array.data, size[0], size[1], self.array.strides[0], QImage.Format_BGR888)
+
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        if frame.strides[-1] != frame.itemsize or frame.strides[-2] != frame.itemsize * frame.shape[-1]:
+            frame = np.ascontiguousarray(frame)  # OpenCV needs packed pixels; row padding is fine
+        if frame.shape[1::-1] == size:
+            np.copyto(self.array, frame)
+        else:
+            cv2.resize(frame, size, dst=self.array, interpolation=cv2.INTER_AREA)
+        return self.qimage
+
+
+class ImageDisplay(QLabel):
+    """Label that paints frames straight from a DisplayBuffer, without converting them to a QPixmap."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = DisplayBuffer()
+        self.frame = None
+
+    def show_frame(self, frame):
+        self.frame = frame
+        self.refit()
+
+    def refit(self):
+        if self.frame is None:
+            return
+        ratio = self.devicePixelRatioF()
+        self.buffer.update(self.frame, int(self.width() * ratio), int(self.height() * ratio))
+        self.buffer.qimage.setDevicePixelRatio(ratio)
+        self.setText("")
+        self.update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.refit()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        image = self.buffer.qimage
+        if self.frame is None or image is None:
+            return
+        ratio = image.devicePixelRatio()
+        x = (self.width() - image.width() / ratio) / 2
+        y = (self.height() - image.height() / ratio) / 2
+        painter = QPainter(self)
+        painter.drawImage(int(x), int(y), image)
+        painter.end()
 
 
 def create_image_display():
-    image_label = QLabel()
+    image_label = ImageDisplay()
     image_label.setAlignment(Qt.AlignCenter)
     image_label.setStyleSheet("background-color: #222;")
     image_label.setText("No image loaded")
-    return image_label
\ No newline at end of file
+    return image_label
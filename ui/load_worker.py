@@ -0,0 +1,85 @@
+import threading
+
+from PySide6.QtCore import QThread, Signal
+
+from utils.image_loading import load_original, read_first_paint
+
+
+class LoadWorker(QThread):
+    """Decodes images off the GUI thread, always on the newest requested file.
+
+    Each load first emits a quick low-resolution version (the EXIF thumbnail or a reduced decode)
+    for an immediate first paint, then the full-resolution, read-only original. Requesting another
+    file supersedes the one pending, and results of superseded loads are never emitted.
+    """
+
+    # generation, path, low-resolution image
+    first_paint = Signal(int, str, object)
+    # generation, path, read-only full-resolution image
+    loaded = Signal(int, str, object)
+    # generation, path, error message
+    failed = Signal(int, str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self._pending = None
+        self._stopping = False
+        self._condition = threading.Condition()
+
+    def submit(self, path, target_size, decode=load_original):
+        """Queue a load of path, first painted at about target_size (width, height); return its generation.
+
+        decode(path) returns the read-only original, e.g. from an ImageSession that may already
+        be decoding it.
+        """
+        with self._condition:
+            self.generation += 1
+            self._pending = (self.generation, path, target_size, decode)
+            self._condition.notify()
+            return self.generation
+
+    def cancel(self):
+        """Drop the pending load and keep the one in flight from emitting anything more."""
+        with self._condition:
+            self.generation += 1
+            self._pending = None
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self.generation += 1
+            self._pending = None
+            self._condition.notify()
+        self.wait()
+
+    def is_stale(self, generation):
+        return generation != self.generation or self._stopping
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                generation, path, target_size, decode = self._pending
+                self._pending = None
+
+            try:
+                preview = read_first_paint(path, target_size)
+                if preview is not None and not self.is_stale(generation):
+                    self.first_paint.emit(generation, path, preview)
+            except Exception as e:
+                print(f"Error reading first paint of {path}: {e}")
+
+            if self.is_stale(generation):
+                continue
+            try:
+                image = decode(path)
+            except Exception as e:
+                if not self.is_stale(generation):
+                    self.failed.emit(generation, path, str(e))
+                continue
+            if not self.is_stale(generation):
+                self.loaded.emit(generation, path, image)
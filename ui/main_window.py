@@ -1,11 +1,12 @@
-import cv2
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QImage, QPixmap
-from PySide6.QtWidgets import QMainWindow, QHBoxLayout, QWidget, QFileDialog, QVBoxLayout, QFrame, QPushButton
+from PySide6.QtWidgets import QMainWindow, QHBoxLayout, QWidget, QFileDialog, QVBoxLayout, QFrame, QPushButton, QLabel
 from ui.menu import create_menu_widget
 from ui.image_display import create_image_display
+from ui.render_worker import RenderWorker
 from ui.slider import create_slider
-from effects.filters import apply_gaussian_blur, apply_median_blur, apply_bilateral_blur, apply_box_blur
+from effects.pipeline import PipelineCache, build_stages
+from effects.registry import operations_of_kind
+from utils.history import EditHistory
+from utils.image_loading import load_original
 
 
 class ImageFilterApp(QMainWindow):
@@ -36,19 +37,65 @@ class ImageFilterApp(QMainWindow):
         # Create menu widget
         self.menu_widget, self.animation, self.menu_open = create_menu_widget(self)
 
+        # Initialize variables for image and filters
+        self.image = None
+        self.original_image = None
+        self.image_id = 0  # Keys the cached stage outputs of each loaded image apart
+        self.history = EditHistory()  # Control snapshots, re-rendered on undo
+        self.pipeline_cache = PipelineCache()
+        self.active_filters = {}
+        self.full_render_job = None  # (generation, controls state) of the render in flight
+
+        # Blur buttons and the shared intensity slider, one button per registered blur
+        self.blurs_menu = QFrame()
+        self.blurs_menu.setFixedWidth(0)
+        blurs_layout = QVBoxLayout()
+        self.blurs_menu.setLayout(blurs_layout)
+        blur_operations = operations_of_kind("blur")
+        self.filter_buttons = {}
+        for name, operation in blur_operations.items():
+            button = QPushButton(operation.label)
+            button.setCheckable(True)
+            button.clicked.connect(lambda checked, n=name: self.toggle_filter(n, checked))
+            blurs_layout.addWidget(button)
+            self.filter_buttons[name] = button
+        low = min(operation.value_range[0] for operation in blur_operations.values())
+        high = max(operation.value_range[1] for operation in blur_operations.values())
+        self.slider = create_slider(low, high, 5, lambda value: self.update_control('intensity'))
+        self.slider.sliderReleased.connect(self.history.close_group)
+        blurs_layout.addWidget(self.slider)
+
+        # One slider per registered adjustment
+        self.adjustments_menu = QFrame()
+        self.adjustments_menu.setFixedWidth(0)
+        adjustments_layout = QVBoxLayout()
+        self.adjustments_menu.setLayout(adjustments_layout)
+        self.adjustment_sliders = {}
+        for name, operation in operations_of_kind("adjustment").items():
+            adjustments_layout.addWidget(QLabel(operation.label))
+            slider = create_slider(*operation.value_range, 0, lambda value, n=name: self.update_control(n))
+            slider.sliderReleased.connect(self.history.close_group)
+            adjustments_layout.addWidget(slider)
+            self.adjustment_sliders[name] = slider
+
         # Image display area
         self.image_label = create_image_display()
 
         # Add widgets to the main layout
         main_layout.addWidget(toggle_button_frame)  # Burger menu button always visible
         main_layout.addWidget(self.menu_widget)     # Collapsible menu
+        main_layout.addWidget(self.blurs_menu)
+        main_layout.addWidget(self.adjustments_menu)
         main_layout.addWidget(self.image_label, 1)  # Image display takes remaining space
 
-        # Initialize variables for image and filters
-        self.image = None
-        self.original_image = None
-        self.checkpoints = []  # Initialize checkpoints
-        self.active_filters = {}
+        # Filtering runs on a worker thread that only ever renders the newest controls
+        self.render_worker = RenderWorker(self.pipeline_cache, self)
+        self.render_worker.rendered.connect(self.on_render_finished)
+        self.render_worker.start()
+
+    def closeEvent(self, event):
+        self.render_worker.stop()
+        super().closeEvent(event)
 
     def toggle_menu(self):
         if self.menu_open:
@@ -74,49 +121,91 @@ class ImageFilterApp(QMainWindow):
         else:
             self.adjustments_menu.setFixedWidth(200)
 
+    def toggle_filter(self, name, active):
+        self.active_filters[name] = active
+        self.history.close_group()
+        self.history.record(self.get_controls_state())
+        self.apply_active_filters()
+
+    def update_control(self, name):
+        # A slider drag is one undo step however many values it passes through
+        self.history.record(self.get_controls_state(), group=name)
+        self.apply_active_filters()
+
     def reset_filters(self):
         self.active_filters = {key: False for key in self.active_filters}
+        for button in self.filter_buttons.values():
+            button.setChecked(False)
+        self.history.close_group()
+        self.history.record(self.get_controls_state())
         self.apply_active_filters()
 
+    def get_controls_state(self):
+        """Snapshot every control that affects the render."""
+        return {
+            'filters': dict(self.active_filters),
+            'intensity': self.slider.value(),
+            'adjustments': {name: slider.value() for name, slider in self.adjustment_sliders.items()},
+        }
+
+    def set_controls_state(self, state):
+        """Move every control to a snapshot without triggering renders."""
+        self.active_filters = dict(state['filters'])
+        for name, button in self.filter_buttons.items():
+            button.setChecked(self.active_filters.get(name, False))
+        self.slider.blockSignals(True)
+        self.slider.setValue(state['intensity'])
+        self.slider.blockSignals(False)
+        for name, value in state['adjustments'].items():
+            slider = self.adjustment_sliders[name]
+            slider.blockSignals(True)
+            slider.setValue(value)
+            slider.blockSignals(False)
+
     def load_image(self):
         file_name, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Image Files (*.png *.jpg *.bmp)")
         if file_name:
-            self.image = cv2.imread(file_name)
-            self.original_image = self.image.copy()
+            self.render_worker.cancel()
+            self.pipeline_cache.clear()
+            self.image_id += 1
+            self.original_image = load_original(file_name)
+            self.image = self.original_image
+            self.history.reset(self.get_controls_state(), self.original_image)
             self.show_image(self.image)
+            self.apply_active_filters()
 
     def undo_last(self):
-        if self.checkpoints and len(self.checkpoints) > 1:
-            self.checkpoints.pop()  # Remove the current state
-            self.image = self.checkpoints[-1].copy()  # Revert to the previous state
-            self.show_image(self.image)
-        else:
+        step = self.history.undo()
+        if step is None:
             print("No more undo steps available.")
+            return
+        state, frame = step
+        self.render_worker.cancel()
+        self.set_controls_state(state)
+        if frame is not None:
+            self.image = frame
+            self.show_image(frame)
+        else:
+            # The frame was dropped to stay within the history budget, render the snapshot again
+            self.apply_active_filters()
 
     def show_image(self, img):
         if img is not None:
-            height, width, channel = img.shape
-            bytes_per_line = 3 * width
-            q_img = QImage(img.data, width, height, bytes_per_line, QImage.Format_BGR888)
-            pixmap = QPixmap.fromImage(q_img)
-            self.image_label.setPixmap(
-                pixmap.scaled(self.image_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+            self.image_label.show_frame(img)
 
     def apply_active_filters(self):
         if self.image is not None:
-            current_image = self.original_image.copy()
-            intensity = self.slider.value()
-
-            # Apply active filters in sequence
-            if self.active_filters.get('gaussian'):
-                current_image = apply_gaussian_blur(current_image, intensity)
-            if self.active_filters.get('median'):
-                current_image = apply_median_blur(current_image, intensity)
-            if self.active_filters.get('bilateral'):
-                current_image = apply_bilateral_blur(current_image, intensity)
-            if self.active_filters.get('box'):
-                current_image = apply_box_blur(current_image, intensity)
-
-            self.image = current_image
-            self.checkpoints.append(current_image.copy())
-            self.show_image(current_image)
\ No newline at end of file
+            # Run the active blurs and adjustments in registry order, from the original image
+            adjustments = {name: slider.value() for name, slider in self.adjustment_sliders.items()}
+            stages = build_stages(self.active_filters, self.slider.value(), adjustments)
+            generation = self.render_worker.submit(self.original_image, stages, ("source", self.image_id))
+            self.full_render_job = (generation, self.get_controls_state())
+
+    def on_render_finished(self, generation, preview, current_image):
+        if generation != self.render_worker.generation:
+            return  # Superseded while the result was queued for the GUI thread
+        # Update the current image and let the history keep it while it fits the budget
+        self.image = current_image
+        if self.full_render_job is not None and self.full_render_job[0] == generation:
+            self.history.store_frame(self.full_render_job[1], current_image)
+        self.show_image(current_image)
@@ -0,0 +1,132 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from PySide6.QtCore import QThread, Signal
+
+from effects.pipeline import run_pipeline, stage_keys
+from effects.render_cache import render_key, source_digest
+from effects.tiling import run_stage_tiled
+from effects.working_space import DEFAULT_WORKING_SPACE
+from utils.profiling import StageProfiler
+
+# Full-resolution renders at least this large split every stage into tiles across all cores
+PARALLEL_MIN_PIXELS = 4 * 1024 * 1024
+
+
+class RenderWorker(QThread):
+    """Runs the filter pipeline off the GUI thread, always on the newest submitted job.
+
+    Only one job is kept pending: submitting replaces whatever has not started yet, and the job in
+    flight is cancelled at its next stage boundary. Interactive latency is therefore one render,
+    however many slider events arrived while it ran.
+
+    With a disk_cache (a DiskRenderCache), full renders found on disk are shown without running the
+    stages, and new ones are written there in the background.
+    """
+
+    # generation, preview flag, rendered image
+    rendered = Signal(int, bool, object)
+    # StageProfiler summary of every render that ran, finished or cancelled
+    profiled = Signal(object)
+
+    def __init__(self, cache, parent=None, disk_cache=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.disk_cache = disk_cache
+        self._disk_writer = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self._pending = None
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._tile_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        self.profiler = StageProfiler()
+
+    def submit(self, source, stages, source_key="source", preview=False, working_space=DEFAULT_WORKING_SPACE):
+        """Queue a render, superseding any pending or in-flight one, and return its generation."""
+        with self._condition:
+            self.generation += 1
+            self._pending = (self.generation, source, stages, source_key, preview, working_space)
+            self._condition.notify()
+            return self.generation
+
+    def cancel(self):
+        """Drop the pending job and cancel the one in flight."""
+        with self._condition:
+            self.generation += 1
+            self._pending = None
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self.generation += 1
+            self._pending = None
+            self._condition.notify()
+        self.wait()
+        self._tile_pool.shutdown()
+        self._disk_writer.shutdown()
+
+    def is_stale(self, generation):
+        return generation != self.generation or self._stopping
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                generation, source, stages, source_key, preview, working_space = self._pending
+                self._pending = None
+
+            disk_key = None
+            if self.disk_cache is not None and not preview and stages:
+                try:
+                    disk_key, image = self._read_disk_cache(source, stages, source_key, working_space)
+                except Exception as e:
+                    print(f"Error reading the render cache: {e}")
+                    disk_key, image = None, None
+                if image is not None:
+                    if not self.is_stale(generation):
+                        self.rendered.emit(generation, preview, image)
+                    continue
+
+            run_stage = None
+            if source.shape[0] * source.shape[1] >= PARALLEL_MIN_PIXELS:
+                run_stage = partial(run_stage_tiled, pool=self._tile_pool)
+            try:
+                self.profiler.begin(f"{'Preview' if preview else 'Full'} render #{generation}", run_stage)
+                image = run_pipeline(source, stages, self.cache, source_key,
+                                     is_cancelled=lambda: self.is_stale(generation), run_stage=self.profiler.run_stage,
+                                     working_space=working_space)
+                self.profiled.emit(self.profiler.end(cancelled=image is None))
+            except Exception as e:
+                print(f"Error in render worker: {e}")
+                continue
+
+            if image is not None and disk_key is not None:
+                self._disk_writer.submit(self._write_disk_cache, disk_key, image)
+            if image is not None and not self.is_stale(generation):
+                self.rendered.emit(generation, preview, image)
+
+    def _read_disk_cache(self, source, stages, source_key, working_space):
+        """Return (key, image): the render's disk cache key and the cached render, or None on a miss.
+
+        Renders still in the in-memory cache are quicker to take from there, so they give (None, None).
+        """
+        memory_key = stage_keys(stages, source_key if working_space == DEFAULT_WORKING_SPACE
+                                else (source_key, working_space))[-1]
+        if memory_key in self.cache:
+            return None, None
+        key = render_key(source_digest(source), stages, working_space)
+        image = self.disk_cache.get(key)
+        if image is not None:
+            print("Render found in the disk cache.")
+        return key, image
+
+    def _write_disk_cache(self, key, image):
+        try:
+            self.disk_cache.put(key, image)
+        except Exception as e:
+            print(f"Error writing the render cache: {e}")
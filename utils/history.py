@@ -0,0 +1,94 @@
+from collections import OrderedDict
+
+DEFAULT_HISTORY_BYTES = 256 * 1024 * 1024
+
+
+class EditHistory:
+    """Undo/redo history of control states, with rendered frames kept only within a byte budget.
+
+    Each entry is a snapshot of the controls (a small dict), so undo can always re-render it.
+    Rendered frames are attached to entries as a shortcut and the oldest ones are dropped first
+    once max_bytes is exceeded. Changes recorded with the same group, e.g. one slider being
+    dragged, collapse into a single entry until close_group is called.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_HISTORY_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._states = []
+        self._index = -1
+        self._open_group = None
+        self._frames = OrderedDict()  # entry index -> frame, oldest first
+
+    def reset(self, state, frame=None):
+        """Start a new history whose only entry is state."""
+        self._states = [state]
+        self._index = 0
+        self._open_group = None
+        self._frames.clear()
+        self.nbytes = 0
+        if frame is not None:
+            self.store_frame(state, frame)
+
+    @property
+    def current(self):
+        return self._states[self._index] if self._states else None
+
+    def can_undo(self):
+        return self._index > 0
+
+    def can_redo(self):
+        return self._index < len(self._states) - 1
+
+    def record(self, state, group=None):
+        """Record a new control state, merging it into the open entry when the group matches."""
+        if not self._states or state == self.current:
+            return
+        self._drop_redo()
+        if group is not None and group == self._open_group and self._index > 0:
+            self._states[self._index] = state
+            self._drop_frame(self._index)
+        else:
+            self._states.append(state)
+            self._index += 1
+        self._open_group = group
+
+    def close_group(self):
+        self._open_group = None
+
+    def undo(self):
+        """Step back and return the (state, frame or None) to show, or None at the oldest entry."""
+        self.close_group()
+        if not self.can_undo():
+            return None
+        self._index -= 1
+        return self.current, self._frames.get(self._index)
+
+    def redo(self):
+        """Step forward and return the (state, frame or None) to show, or None at the newest entry."""
+        self.close_group()
+        if not self.can_redo():
+            return None
+        self._index += 1
+        return self.current, self._frames.get(self._index)
+
+    def store_frame(self, state, frame):
+        """Keep the rendered frame for the current entry if it still shows state."""
+        if state != self.current or frame.nbytes > self.max_bytes:
+            return
+        self._drop_frame(self._index)
+        self._frames[self._index] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes:
+            _, dropped = self._frames.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+
+    def _drop_frame(self, index):
+        frame = self._frames.pop(index, None)
+        if frame is not None:
+            self.nbytes -= frame.nbytes
+
+    def _drop_redo(self):
+        for index in range(self._index + 1, len(self._states)):
+            self._drop_frame(index)
+        del self._states[self._index + 1:]
@@ -0,0 +1,144 @@
+import struct
+
+import cv2
+import numpy as np
+
+# Reduced JPEG decodes, by downscale factor. libjpeg scales while it decodes, so a 1/8 decode
+# only runs the inverse DCT for one coefficient per 8x8 block.
+REDUCED_DECODE_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+
+# EXIF orientation (tag 0x0112) -> function(image) turning the stored pixels upright, as cv2.imread does
+ORIENTATIONS = {
+    2: lambda image: cv2.flip(image, 1),
+    3: lambda image: cv2.rotate(image, cv2.ROTATE_180),
+    4: lambda image: cv2.flip(image, 0),
+    5: cv2.transpose,
+    6: lambda image: cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE),
+    7: lambda image: cv2.flip(cv2.transpose(image), -1),
+    8: lambda image: cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE),
+}
+
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_jpeg_header(path):
+    """Return (width, height, exif) of a JPEG from its headers, without decoding it.
+
+    exif is the raw TIFF block of the APP1 Exif segment, or None. Returns None for files that
+    are not JPEGs. Only the marker segments before the image data are read.
+    """
+    width = height = exif = None
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                break
+            if marker[1] == 0xFF:  # Fill byte
+                f.seek(-1, 1)
+                continue
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                continue  # Markers without a length
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                break
+            length = struct.unpack(">H", length_bytes)[0] - 2
+            if marker[1] == 0xDA:  # Start of scan: the headers are over
+                break
+            if marker[1] == 0xE1 and exif is None:
+                segment = f.read(length)
+                if segment.startswith(b"Exif\x00\x00"):
+                    exif = segment[6:]
+            elif marker[1] in _SOF_MARKERS:
+                segment = f.read(length)
+                height, width = struct.unpack(">HH", segment[1:5])
+            else:
+                f.seek(length, 1)
+    if width is None:
+        return None
+    return width, height, exif
+
+
+def _read_ifd(tiff, offset, order):
+    """Return ({tag: value or offset}, next IFD offset) for the TIFF IFD at offset."""
+    count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+    entries = {}
+    for i in range(count):
+        start = offset + 2 + 12 * i
+        tag, kind = struct.unpack(order + "HH", tiff[start:start + 4])
+        if kind == 3:  # SHORT, stored in the first two bytes of the value field
+            entries[tag] = struct.unpack(order + "H", tiff[start + 8:start + 10])[0]
+        else:
+            entries[tag] = struct.unpack(order + "I", tiff[start + 8:start + 12])[0]
+    end = offset + 2 + 12 * count
+    return entries, struct.unpack(order + "I", tiff[end:end + 4])[0]
+
+
+def exif_thumbnail(exif):
+    """Return the JPEG thumbnail embedded in an EXIF block, decoded and turned upright, or None."""
+    try:
+        order = {b"II": "<", b"MM": ">"}[exif[:2]]
+        first, next_offset = _read_ifd(exif, struct.unpack(order + "I", exif[4:8])[0], order)
+        if not next_offset:
+            return None
+        thumbnail, _ = _read_ifd(exif, next_offset, order)
+        start, length = thumbnail.get(0x0201), thumbnail.get(0x0202)  # JPEGInterchangeFormat(Length)
+        if not start or not length:
+            return None
+        image = cv2.imdecode(np.frombuffer(exif[start:start + length], np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        orient = ORIENTATIONS.get(first.get(0x0112))
+        return orient(image) if orient else image
+    except (KeyError, struct.error):
+        return None
+
+
+def reduced_factor(size, target_size):
+    """Return the largest REDUCED_DECODE_FLAGS factor that keeps size at least target_size, or 1."""
+    width, height = size
+    target_width, target_height = target_size
+    for factor in REDUCED_DECODE_FLAGS:
+        if width // factor >= target_width and height // factor >= target_height:
+            return factor
+    return 1
+
+
+def read_first_paint(path, target_size):
+    """Return a quick low-resolution version of the image at path to show while it decodes, or None.
+
+    The EXIF thumbnail is used if the JPEG has one, otherwise a reduced decode at the smallest
+    scale still covering target_size (width, height). Files other than JPEGs, and JPEGs not much
+    larger than target_size, get None: their full decode is about as fast.
+    """
+    header = read_jpeg_header(path)
+    if header is None:
+        return None
+    width, height, exif = header
+    if exif is not None:
+        thumbnail = exif_thumbnail(exif)
+        if thumbnail is not None:
+            return thumbnail
+    factor = reduced_factor((width, height), target_size)
+    if factor == 1:
+        return None
+    return cv2.imread(path, REDUCED_DECODE_FLAGS[factor])
+
+
+def freeze(image):
+    """Mark image read-only and return it, so it can be shared without defensive copies."""
+    image.flags.writeable = False
+    return image
+
+
+def load_original(path):
+    """Decode the image at path at full resolution into a read-only array.
+
+    The result is the one original every render, preview proxy and reset reads from; writing
+    into it raises instead of silently corrupting them.
+    """
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError("Failed to load image. Check the file format or path.")
+    return freeze(image)
@@ -1,8 +1,10 @@
+import numpy as np
 from PySide6.QtGui import QImage, QPixmap
 
 
 def convert_cv_to_qt(img):
-    height, width, channel = img.shape
-    bytes_per_line = 3 * widthi
-    q_img = QImage(img.data, width, height, bytes_per_line, QImage.Format_BGR888)
-    return QPixmap.fromImage(q_img)
+    """Return a QPixmap of a uint8 BGR image; views with any strides are packed first."""
+    img = np.ascontiguousarray(img)
+    height, width = img.shape[:2]
+    q_img = QImage(img.data, width, height, img.strides[0], QImage.Format_BGR888)
+    return QPixmap.fromImage(q_img)  # Copies the pixels, so img may be freed afterwards
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger("imgblur.profile")
+
+# Set to a file path to log every stage of every render as JSON lines
+PROFILE_LOG_ENV = "IMGBLUR_PROFILE_LOG"
+
+
+def enable_json_log(path):
+    """Append one JSON object per profiled stage and per render to path."""
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return handler
+
+
+def enable_json_log_from_env():
+    path = os.environ.get(PROFILE_LOG_ENV)
+    return enable_json_log(path) if path else None
+
+
+def _run_stage(image, stage, out=None):
+    _, function, value = stage
+    return function(image, value, out=out)
+
+
+class StageProfiler:
+    """Records wall time, bytes allocated and output shape for every stage a render runs.
+
+    Use profiler.run_stage as run_pipeline's run_stage hook, between begin() and end(). Without
+    trace_memory, bytes allocated is the size of each stage's output, or 0 when the stage wrote into
+    the buffer it was given or into its input; with it, it is the peak
+    traced by tracemalloc while the stage ran, which includes temporaries but slows stages down.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self._local = threading.local()
+
+    def begin(self, label, inner=None):
+        """Start profiling a render; inner is the run_stage hook the stages really go through."""
+        self._local.render = {"label": label, "started": time.time(), "stages": []}
+        self._local.inner = inner or _run_stage
+        self._local.start = time.perf_counter()
+
+    def run_stage(self, image, stage, out=None):
+        name, _, value = stage
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = self._local.inner(image, stage, out)
+        finally:
+            seconds = time.perf_counter() - start
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        if not tracing:
+            peak = result.nbytes if result is not image and result is not out else 0
+
+        record = {
+            "event": "stage",
+            "render": self._local.render["label"],
+            "stage": name,
+            "value": value if isinstance(value, (int, float)) else repr(value),
+            "seconds": seconds,
+            "bytes_allocated": peak,
+            "input_shape": list(image.shape),
+            "output_shape": list(result.shape),
+        }
+        self._local.render["stages"].append(record)
+        logger.info(json.dumps(record))
+        return result
+
+    def end(self, cancelled=False):
+        """Finish the render and return its summary, with the slowest stage as "hot_stage"."""
+        render = self._local.render
+        stages = render["stages"]
+        hot = max(stages, key=lambda record: record["seconds"]) if stages else None
+        summary = {
+            "event": "render",
+            "render": render["label"],
+            "started": render["started"],
+            "seconds": time.perf_counter() - self._local.start,
+            "stages": stages,
+            "hot_stage": hot["stage"] if hot else None,
+            "bytes_allocated": sum(record["bytes_allocated"] for record in stages),
+            "cancelled": cancelled,
+        }
+        logger.info(json.dumps({key: value for key, value in summary.items() if key != "stages"}))
+        return summary
+
+
+def format_summary(summary):
+    """Return a one-line description of a render summary for a status bar."""
+    text = f"{summary['render']}: {summary['seconds'] * 1000:.0f} ms"
+    if not summary["stages"]:
+        return text + ", all stages cached"
+    parts = [f"{record['stage']} {record['seconds'] * 1000:.0f} ms" for record in summary["stages"]]
+    text += f" ({len(parts)} stage(s) run: {', '.join(parts)})"
+    text += f", {summary['bytes_allocated'] / 2 ** 20:.0f} MiB allocated"
+    if summary["hot_stage"]:
+        text += f", hot: {summary['hot_stage']}"
+    return text
@@ -0,0 +1,171 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.image_loading import load_original
+
+DEFAULT_SESSION_BYTES = 1024 * 1024 * 1024
+
+# Files a session picks up from a folder
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+# Neighbours decoded ahead of time around the current image, in the direction of travel first
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
+PREFETCH_WORKERS = 2
+
+
+class _Entry:
+    """What a session keeps for one file: its original, preview proxies and last render."""
+
+    def __init__(self):
+        self.original = None
+        self.previews = {}  # (width, height) -> proxy
+        self.render = None  # (controls state, rendered image)
+
+    @property
+    def nbytes(self):
+        arrays = [self.original, self.render[1] if self.render else None, *self.previews.values()]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+
+class ImageSession:
+    """Ordered list of files under review, keeping the decoded images of recently viewed ones.
+
+    For every file the session holds its decoded read-only original, its preview proxies and its
+    last rendered result, in an LRU cache bounded by max_bytes; the current file is never evicted.
+    Each file's controls state is also kept (it is small and never evicted), so edits survive
+    stepping away. Neighbours of the current file are decoded ahead on a background pool.
+    """
+
+    def __init__(self, paths, index=0, max_bytes=DEFAULT_SESSION_BYTES, workers=PREFETCH_WORKERS):
+        if not paths:
+            raise ValueError("A session needs at least one image.")
+        self.paths = list(paths)
+        self.index = index
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.states = {}  # path -> controls state
+        self.direction = 1
+        self._entries = OrderedDict()  # path -> _Entry, least recently used first
+        self._decoding = {}  # path -> Future of its original
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Return a session over every image in path's folder, sorted by name, positioned on path."""
+        folder = os.path.dirname(os.path.abspath(path))
+        paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        path = os.path.abspath(path)
+        if path not in paths:
+            paths.append(path)
+        return cls(paths, paths.index(path), **kwargs)
+
+    @property
+    def current(self):
+        return self.paths[self.index]
+
+    def image_id(self, path):
+        """Return a number identifying path in cache keys, stable for the life of the session."""
+        return self.paths.index(path) + 1
+
+    def step(self, delta):
+        """Move delta files along (clamped to the ends) and return the new current path."""
+        self.index = min(max(self.index + delta, 0), len(self.paths) - 1)
+        self.direction = 1 if delta >= 0 else -1
+        with self._lock:
+            self._evict()
+        return self.current
+
+    def original(self, path):
+        """Return path's decoded original if the session holds it, else None."""
+        with self._lock:
+            entry = self._touch(path)
+            return entry.original if entry else None
+
+    def decode(self, path):
+        """Return path's read-only original, from the cache, a prefetch in flight, or decoding it now."""
+        image = self.original(path)
+        if image is not None:
+            return image
+        with self._lock:
+            future = self._decoding.get(path)
+        if future is not None and not future.cancel():
+            return future.result()  # Already decoding: wait for it rather than decode twice
+        return self._decode(path)
+
+    def prefetch(self):
+        """Start decoding the neighbours of the current file, dropping prefetches no longer near it."""
+        ahead = [self.index + self.direction * step for step in range(1, PREFETCH_AHEAD + 1)]
+        behind = [self.index - self.direction * step for step in range(1, PREFETCH_BEHIND + 1)]
+        wanted = [self.paths[i] for i in ahead + behind if 0 <= i < len(self.paths)]
+        with self._lock:
+            for path, future in list(self._decoding.items()):
+                if path not in wanted and future.cancel():
+                    del self._decoding[path]
+            for path in wanted:
+                entry = self._entries.get(path)
+                if (entry is None or entry.original is None) and path not in self._decoding:
+                    self._decoding[path] = self._pool.submit(self._decode, path)
+
+    def _decode(self, path):
+        try:
+            image = load_original(path)
+        except Exception:
+            with self._lock:
+                self._decoding.pop(path, None)
+            raise
+        with self._lock:
+            self._store(path, lambda entry: setattr(entry, "original", image))
+            self._decoding.pop(path, None)
+        return image
+
+    def preview(self, path, size):
+        """Return path's preview proxy at size (width, height) if the session holds it, else None."""
+        with self._lock:
+            entry = self._touch(path)
+            return entry.previews.get(size) if entry else None
+
+    def store_preview(self, path, size, image):
+        with self._lock:
+            self._store(path, lambda entry: entry.previews.__setitem__(size, image))
+
+    def render(self, path, state):
+        """Return path's last rendered image if it was rendered from state, else None."""
+        with self._lock:
+            entry = self._touch(path)
+            if entry is None or entry.render is None or entry.render[0] != state:
+                return None
+            return entry.render[1]
+
+    def store_render(self, path, state, image):
+        with self._lock:
+            self._store(path, lambda entry: setattr(entry, "render", (state, image)))
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _touch(self, path):
+        entry = self._entries.get(path)
+        if entry is not None:
+            self._entries.move_to_end(path)
+        return entry
+
+    def _store(self, path, update):
+        entry = self._entries.pop(path, None) or _Entry()
+        self.nbytes -= entry.nbytes
+        update(entry)
+        self._entries[path] = entry
+        self.nbytes += entry.nbytes
+        self._evict()
+
+    def _evict(self):
+        for path in list(self._entries):
+            if self.nbytes <= self.max_bytes:
+                break
+            if path == self.current:
+                continue
+            self.nbytes -= self._entries.pop(path).nbytes
@@ -0,0 +1,139 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+# TIFF compression schemes the writer supports, by the name used in export options
+TIFF_COMPRESSIONS = {"none": 1, "deflate": 8}
+
+# Classic TIFF addresses its file with 32-bit offsets; anything that might not fit goes BigTIFF
+CLASSIC_TIFF_MAX_BYTES = 2 ** 32 - 2 ** 24
+
+_SHORT, _LONG, _LONG8 = 3, 4, 16
+
+
+class TiledTiffWriter:
+    """Writes an 8-bit BGR or greyscale image to a tiled TIFF one tile at a time.
+
+    Tiles may be written in any order, each as soon as it is ready, so the whole image never has
+    to be in memory. Deflate tiles use the horizontal predictor, which roughly halves the size of
+    photographs. The image directory goes at the end, written by close(), and the file only
+    appears under path once it is complete.
+    """
+
+    def __init__(self, path, width, height, channels=3, tile_size=1024, compression="deflate", level=6):
+        if tile_size % 16:
+            raise ValueError("TIFF tile size must be a multiple of 16.")
+        if compression not in TIFF_COMPRESSIONS:
+            raise ValueError(f"Unknown TIFF compression '{compression}'. "
+                             f"Expected one of: {', '.join(TIFF_COMPRESSIONS)}.")
+        self.path = path
+        self.width, self.height, self.channels = width, height, channels
+        self.tile_size = tile_size
+        self.compression = compression
+        self.level = level
+        self.bigtiff = width * height * channels + 2 ** 20 > CLASSIC_TIFF_MAX_BYTES
+        self.tiles_across = -(-width // tile_size)
+        self.tiles_down = -(-height // tile_size)
+        self._offsets = [0] * (self.tiles_across * self.tiles_down)
+        self._counts = [0] * len(self._offsets)
+        self._temporary = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                       f".{os.path.basename(path)}.{os.getpid()}.tmp")
+        self._file = open(self._temporary, "wb")
+        self._file.write(b"\0" * (16 if self.bigtiff else 8))  # Header, filled in by close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    def encode_tile(self, tile):
+        """Return the bytes of an image tile of at most tile_size square, padded and compressed.
+
+        Safe to call from several threads at once, so tiles can be compressed in parallel.
+        """
+        padded = np.zeros((self.tile_size, self.tile_size, self.channels), dtype=np.uint8)
+        pixels = tile.reshape(tile.shape[0], tile.shape[1], -1)
+        padded[:tile.shape[0], :tile.shape[1]] = pixels[..., ::-1] if self.channels == 3 else pixels  # BGR to RGB
+        if self.compression == "none":
+            return padded.tobytes()
+        padded[:, 1:] -= padded[:, :-1].copy()  # Horizontal predictor: each sample minus its left neighbour
+        return zlib.compress(padded.tobytes(), self.level)
+
+    def write_tile(self, y, x, data):
+        """Append the encode_tile bytes of the tile whose top-left pixel is (y, x)."""
+        index = (y // self.tile_size) * self.tiles_across + x // self.tile_size
+        self._offsets[index] = self._file.tell()
+        self._counts[index] = len(data)
+        self._file.write(data)
+        if self._file.tell() % 2:
+            self._file.write(b"\0")  # Keep offsets word-aligned
+
+    def close(self):
+        if not all(self._counts):
+            self.abort()
+            raise ValueError("Not every tile of the TIFF was written.")
+        offset_type = _LONG8 if self.bigtiff else _LONG
+        entries = [
+            (256, _LONG, [self.width]),
+            (257, _LONG, [self.height]),
+            (258, _SHORT, [8] * self.channels),
+            (259, _SHORT, [TIFF_COMPRESSIONS[self.compression]]),
+            (262, _SHORT, [2 if self.channels == 3 else 1]),  # RGB or black is zero
+            (277, _SHORT, [self.channels]),
+            (284, _SHORT, [1]),  # Samples stored interleaved
+            (322, _LONG, [self.tile_size]),
+            (323, _LONG, [self.tile_size]),
+            (324, offset_type, self._offsets),
+            (325, offset_type, self._counts),
+        ]
+        if self.compression == "deflate":
+            entries.append((317, _SHORT, [2]))  # Horizontal differencing predictor
+            entries.sort()
+        self._write_directory(entries)
+        self._file.close()
+        os.replace(self._temporary, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._temporary):
+            os.remove(self._temporary)
+
+    def _write_directory(self, entries):
+        f = self._file
+        inline = 8 if self.bigtiff else 4
+        formats = {_SHORT: "H", _LONG: "I", _LONG8: "Q"}
+        # Values too large for their entry go before the directory, which then points at them
+        packed = {}
+        for tag, kind, values in entries:
+            data = struct.pack(f"<{len(values)}{formats[kind]}", *values)
+            if len(data) > inline:
+                packed[tag] = f.tell()
+                f.write(data)
+                if f.tell() % 2:
+                    f.write(b"\0")
+        directory = f.tell()
+        if self.bigtiff:
+            f.write(struct.pack("<Q", len(entries)))
+        else:
+            f.write(struct.pack("<H", len(entries)))
+        for tag, kind, values in entries:
+            if tag in packed:
+                value = struct.pack("<Q" if self.bigtiff else "<I", packed[tag])
+            else:
+                value = struct.pack(f"<{len(values)}{formats[kind]}", *values).ljust(inline, b"\0")
+            if self.bigtiff:
+                f.write(struct.pack("<HHQ", tag, kind, len(values)) + value)
+            else:
+                f.write(struct.pack("<HHI", tag, kind, len(values)) + value)
+        f.write(b"\0" * (8 if self.bigtiff else 4))  # No further directories
+        f.seek(0)
+        if self.bigtiff:
+            f.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, directory))
+        else:
+            f.write(b"II" + struct.pack("<HI", 42, directory))